@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from app import metrics
+from app.llm import LlamaCPPClient, server_root
+
+logger = logging.getLogger(__name__)
+
+BACKEND_OUTSTANDING = metrics.REGISTRY.gauge("bonsai_backend_outstanding", "In-flight generations per backend.")
+BACKEND_HEALTHY = metrics.REGISTRY.gauge("bonsai_backend_healthy", "1 if the backend passed its last health check.")
+ADMISSION_REJECTIONS = metrics.REGISTRY.counter(
+    "bonsai_admission_rejections_total", "Requests answered 503 because every backend was saturated."
+)
+
+
+@dataclass
+class Backend:
+    client: LlamaCPPClient
+    max_concurrency: int
+    # Taken from /slots when the config leaves max_concurrency unset.
+    discover_slots: bool = False
+    outstanding: int = 0
+    healthy: bool = True
+    idle_slots: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return self.client.api_base
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "api_base": self.name,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "idle_slots": self.idle_slots,
+            "endpoint": self.client.active_endpoint,
+        }
+
+
+class BackendPool:
+    """
+    Route generations across llama-server instances: least outstanding requests first, at most
+    ``max_concurrency`` per backend, a bounded admission queue when all are busy, and 503 beyond that.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        queue_size: int = 64,
+        queue_timeout_seconds: float = 30.0,
+        session_affinity: bool = False,
+    ) -> None:
+        if not backends:
+            raise ValueError("At least one llama.cpp backend is required")
+        self.backends = backends
+        self.queue_size = queue_size
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.session_affinity = session_affinity
+        self._cond = asyncio.Condition()
+        self._waiting = 0
+        # Passive failure marking needs the health-check loop to bring a backend back.
+        self._checking = False
+        # Moving average of lease length, used for Retry-After.
+        self._lease_seconds = 5.0
+
+    @property
+    def capacity(self) -> int:
+        return sum(backend.max_concurrency for backend in self.backends if backend.healthy) or 1
+
+    def _pick(self, session_id: Optional[str]) -> Optional[Backend]:
+        free = [
+            backend for backend in self.backends if backend.healthy and backend.outstanding < backend.max_concurrency
+        ]
+        if not free:
+            return None
+        if self.session_affinity and session_id and len(self.backends) > 1:
+            # Same backend for a session keeps its KV-cache prefix warm, when that backend has room.
+            preferred = self.backends[zlib.crc32(session_id.encode("utf-8")) % len(self.backends)]
+            if preferred in free:
+                return preferred
+        return min(
+            free,
+            key=lambda backend: (
+                backend.outstanding / backend.max_concurrency,
+                backend.outstanding,
+                -(backend.idle_slots or 0),
+            ),
+        )
+
+    def _reject(self, reason: str) -> HTTPException:
+        ADMISSION_REJECTIONS.inc()
+        return HTTPException(
+            status_code=503,
+            detail=f"All llama.cpp backends are busy ({reason}); retry shortly.",
+            headers={"Retry-After": str(max(1, round(self._lease_seconds)))},
+        )
+
+    async def acquire(self, session_id: Optional[str] = None, background: bool = False) -> Backend:
+        """
+        Reserve a backend, waiting in the admission queue if all are at their limit. Background work
+        (batch answering) waits as long as it takes and does not count against the queue size.
+        """
+        async with self._cond:
+            backend = self._pick(session_id)
+            if backend is None:
+                if not any(backend.healthy for backend in self.backends):
+                    raise self._reject("no healthy backend")
+                if not background and self._waiting >= self.queue_size:
+                    raise self._reject("admission queue full")
+                deadline = None if background else time.monotonic() + self.queue_timeout_seconds
+                self._waiting += 0 if background else 1
+                try:
+                    while backend is None:
+                        timeout = None if deadline is None else deadline - time.monotonic()
+                        if timeout is not None and timeout <= 0:
+                            raise self._reject("timed out in the admission queue")
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), timeout)
+                        except asyncio.TimeoutError:
+                            continue
+                        backend = self._pick(session_id)
+                finally:
+                    self._waiting -= 0 if background else 1
+            backend.outstanding += 1
+            BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.name)
+            return backend
+
+    async def release(self, backend: Backend, seconds: float, failed: bool = False) -> None:
+        async with self._cond:
+            backend.outstanding -= 1
+            BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.name)
+            if failed and backend.healthy and self._checking:
+                logger.warning("Marking llama.cpp backend %s unhealthy after a connection failure", backend.name)
+                self._set_health(backend, False)
+            elif not failed:
+                self._lease_seconds = 0.9 * self._lease_seconds + 0.1 * seconds
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def lease(self, session_id: Optional[str] = None, background: bool = False) -> AsyncIterator[Backend]:
+        backend = await self.acquire(session_id, background)
+        started = time.monotonic()
+        failed = False
+        try:
+            yield backend
+        except httpx.TransportError:
+            failed = True
+            raise
+        except HTTPException as exc:
+            # LlamaCPPClient wraps transport errors; only those say anything about the backend's health.
+            failed = isinstance(exc.__cause__, httpx.TransportError)
+            raise
+        finally:
+            await self.release(backend, time.monotonic() - started, failed)
+
+    def reject_if_saturated(self) -> None:
+        """Fail fast before a streaming response starts, when queueing for a backend would be refused anyway."""
+        if self._pick(None) is None and (
+            self._waiting >= self.queue_size or not any(backend.healthy for backend in self.backends)
+        ):
+            raise self._reject("admission queue full")
+
+    def _set_health(self, backend: Backend, healthy: bool) -> None:
+        if healthy != backend.healthy:
+            logger.info("llama.cpp backend %s is now %s", backend.name, "healthy" if healthy else "unhealthy")
+        backend.healthy = healthy
+        BACKEND_HEALTHY.set(1 if healthy else 0, backend=backend.name)
+
+    async def _check(self, backend: Backend, client: httpx.AsyncClient, timeout: float) -> None:
+        root = server_root(backend.client.api_base)
+        try:
+            resp = await client.get(f"{root}/health", timeout=timeout)
+            # llama-server answers 503 while it is still loading the model.
+            healthy = resp.status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+        if healthy:
+            try:
+                resp = await client.get(f"{root}/slots", timeout=timeout)
+                slots = resp.json() if resp.status_code == 200 else None
+            except (httpx.HTTPError, ValueError):
+                slots = None
+            # /slots is disabled with --no-slots; the health check alone still counts.
+            if isinstance(slots, list) and slots:
+                busy = sum(1 for slot in slots if slot.get("is_processing", slot.get("state", 0) != 0))
+                backend.idle_slots = len(slots) - busy
+                backend.client.slot_count = len(slots)
+                if backend.discover_slots:
+                    backend.max_concurrency = len(slots)
+        self._set_health(backend, healthy)
+
+    async def check_health(self, client: httpx.AsyncClient, timeout: float = 2.0) -> None:
+        await asyncio.gather(*(self._check(backend, client, timeout) for backend in self.backends))
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def run_health_checks(self, client: httpx.AsyncClient, interval_seconds: float) -> None:
+        """Check every backend now, then every ``interval_seconds``; backends count as healthy until checked."""
+        self._checking = True
+        while True:
+            try:
+                await self.check_health(client)
+            except Exception:  # pragma: no cover - keep checking whatever happens
+                logger.exception("Backend health check failed")
+            await asyncio.sleep(interval_seconds)
+
+    def status(self) -> Dict[str, Any]:
+        return {"waiting": self._waiting, "backends": [backend.status() for backend in self.backends]}
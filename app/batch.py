@@ -0,0 +1,75 @@
+import argparse
+import json
+import pathlib
+import sys
+from typing import List
+
+import httpx
+
+from app.config import AppConfig
+
+
+def read_questions(path: pathlib.Path) -> List[str]:
+    """One question per line, or JSON lines with a "question" field."""
+    questions = []
+    with path.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                questions.append(json.loads(line)["question"])
+            else:
+                questions.append(line)
+    return questions
+
+
+def run_batch(api_base: str, questions: List[str], output) -> int:
+    failures = 0
+    with httpx.Client(timeout=None) as client:
+        with client.stream("POST", f"{api_base}/ask/batch", json={"questions": questions}) as resp:
+            if resp.is_error:
+                resp.read()
+                raise RuntimeError(f"/ask/batch failed with {resp.status_code}: {resp.text}")
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                if "error" in json.loads(line):
+                    failures += 1
+                output.write(line + "\n")
+                output.flush()
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Answer a file of questions through the running API's /ask/batch.")
+    parser.add_argument("questions", type=pathlib.Path, help="Text file (one question per line) or JSONL")
+    parser.add_argument(
+        "--config",
+        type=pathlib.Path,
+        default=pathlib.Path("config.yaml"),
+        help="Path to config YAML, used for the default API address (default: config.yaml)",
+    )
+    parser.add_argument("--api", help="API base URL (default: http://127.0.0.1:<server.port>)")
+    parser.add_argument("--output", type=pathlib.Path, help="Write JSONL results here instead of stdout")
+    args = parser.parse_args()
+
+    api_base = args.api or f"http://127.0.0.1:{AppConfig.load(args.config).server.port}"
+    questions = read_questions(args.questions)
+    if not questions:
+        parser.error(f"No questions found in {args.questions}")
+
+    output = args.output.open("w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        failures = run_batch(api_base.rstrip("/"), questions, output)
+    except (httpx.HTTPError, RuntimeError) as exc:
+        parser.exit(1, f"Batch failed: {exc}\n")
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"Answered {len(questions) - failures}/{len(questions)} questions.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
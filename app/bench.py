@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from app import utils
+from app.config import AppConfig
+from app.rag import RAGConfig, RAGPipeline
+
+logger = logging.getLogger(__name__)
+
+# Used when the source directory has no transcripts to learn word sequences from.
+FALLBACK_TEXT = (
+    "Repot black pine in early spring before the candles extend. Keep the roots out of wind and sun. "
+    "Juniper foliage needs full sun to stay dense. Wire the branch before you bend it, and remove the wire "
+    "before it bites into the bark. Water when the top of the soil dries. Maples are defoliated in early "
+    "summer to reduce leaf size. Azaleas want acidic soil such as kanuma. Use cut paste on large wounds."
+)
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(values):
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p90_ms": round(float(p90), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak resident memory of this process and of its finished children (ingest workers)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+
+            return {"self": round(psutil.Process().memory_info().peak_wset / 2**20, 1), "children": None}
+        except (ImportError, AttributeError):
+            return {"self": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return {"self": round(own / 2**20, 1), "children": round(children / 2**20, 1) if children else None}
+
+
+class CorpusGenerator:
+    """
+    Word-bigram model over the real transcripts, so synthetic files have the same vocabulary,
+    sentence lengths and (lack of) structure as ``data/raw``.
+    """
+
+    def __init__(self, source_dir: pathlib.Path, max_words: int = 2_000_000) -> None:
+        words: List[str] = []
+        if source_dir.is_dir():
+            for path in sorted(utils.iter_text_files(source_dir)):
+                words.extend(utils.read_text_file(path).split())
+                if len(words) >= max_words:
+                    break
+        if len(words) < 100:
+            logger.info("No transcripts under %s; generating from a built-in sample", source_dir)
+            words = FALLBACK_TEXT.split()
+        self._successors: Dict[str, List[str]] = defaultdict(list)
+        for current, following in zip(words, words[1:]):
+            self._successors[current].append(following)
+        self._starts = [following for current, following in zip(words, words[1:]) if SENTENCE_END.search(current)]
+        self._starts = self._starts or words[:1]
+
+    def text(self, rng: random.Random, words: int) -> str:
+        out: List[str] = []
+        word = rng.choice(self._starts)
+        while len(out) < words:
+            out.append(word)
+            successors = self._successors.get(word)
+            word = rng.choice(successors) if successors else rng.choice(self._starts)
+        # Finish the last sentence so files end the way transcripts do.
+        if not SENTENCE_END.search(out[-1]):
+            out[-1] += "."
+        return " ".join(out)
+
+    def write(self, target: pathlib.Path, files: int, words_per_file: int, seed: int) -> Dict[str, Any]:
+        """Write ``files`` transcripts whose lengths vary around ``words_per_file`` like the real ones do."""
+        rng = random.Random(seed)
+        target.mkdir(parents=True, exist_ok=True)
+        total_words = total_bytes = 0
+        for number in range(files):
+            length = max(50, int(rng.lognormvariate(0, 0.6) * words_per_file))
+            text = self.text(rng, length)
+            path = target / f"synthetic_{number:05d}.txt"
+            path.write_text(text, encoding="utf-8")
+            total_words += length
+            total_bytes += path.stat().st_size
+        return {"files": files, "words": total_words, "bytes": total_bytes, "seed": seed}
+
+
+def make_questions(corpus_dir: pathlib.Path, count: int, seed: int) -> List[str]:
+    """Distinct questions built from short phrases of the corpus, so no two requests share a cache entry."""
+    rng = random.Random(seed + 1)
+    texts = [utils.read_text_file(path).split() for path in sorted(utils.iter_text_files(corpus_dir))]
+    texts = [words for words in texts if len(words) > 12]
+    questions: Dict[str, None] = {}
+    attempts = 0
+    while len(questions) < count and attempts < count * 20:
+        attempts += 1
+        words = rng.choice(texts)
+        start = rng.randrange(len(words) - 12)
+        phrase = " ".join(words[start : start + rng.randint(4, 10)]).strip(".,!?")
+        questions.setdefault(f"What about {phrase}?", None)
+    if len(questions) < count:
+        raise ValueError(f"Corpus too small to make {count} distinct questions; add files or words")
+    return list(questions)
+
+
+def bench_ingest(pipeline: RAGPipeline, corpus_dir: pathlib.Path, corpus: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    pipeline.load()
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    chunks = pipeline.rebuild(corpus_dir, incremental=False)
+    seconds = time.perf_counter() - started
+    rss = peak_rss_mb()
+    return {
+        "load_seconds": round(load_seconds, 3),
+        "seconds": round(seconds, 3),
+        "chunks": chunks,
+        "files_per_second": round(corpus["files"] / seconds, 2),
+        "chunks_per_second": round(chunks / seconds, 2),
+        "mb_per_second": round(corpus["bytes"] / 2**20 / seconds, 3),
+        "peak_rss_mb": rss["self"],
+        "workers_peak_rss_mb": rss["children"],
+    }
+
+
+async def bench_retrieve(pipeline: RAGPipeline, questions: Sequence[str], concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(question: str) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await pipeline.aretrieve(question)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "requests_per_second": round(len(questions) / wall, 2),
+        **percentiles(latencies),
+    }
+
+
+def build_stub_llama(model_name: str, token_delay_ms: float, completion_tokens: int, slots: int) -> FastAPI:
+    """Just enough of llama-server's API for the app, emitting tokens at a fixed rate."""
+    stub = FastAPI()
+    delay = token_delay_ms / 1000.0
+
+    def tokens(body: Dict[str, Any]) -> List[str]:
+        count = min(completion_tokens, body.get("max_tokens") or completion_tokens)
+        return [f"word{number} " for number in range(count)]
+
+    def usage(body: Dict[str, Any], count: int) -> Dict[str, Any]:
+        prompt = body.get("prompt") or " ".join(message["content"] for message in body.get("messages", []))
+        return {
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": count},
+            "timings": {"prompt_ms": 0.0, "predicted_ms": count * token_delay_ms},
+        }
+
+    @stub.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @stub.get("/slots")
+    async def slot_list():
+        return [{"id": number, "is_processing": False} for number in range(slots)]
+
+    @stub.get("/v1/models")
+    async def models():
+        return {"data": [{"id": model_name}]}
+
+    @stub.post("/tokenize")
+    async def tokenize(request: Request):
+        body = await request.json()
+        return {"tokens": list(range(len(body.get("content", "").split())))}
+
+    async def respond(body: Dict[str, Any], chat: bool):
+        words = tokens(body)
+        if body.get("stream"):
+
+            async def events():
+                for word in words:
+                    await asyncio.sleep(delay)
+                    delta = {"delta": {"content": word}} if chat else {"text": word}
+                    yield f"data: {json.dumps({'choices': [delta]})}\n\n"
+                final = {"choices": [{"delta": {}} if chat else {"text": ""}], **usage(body, len(words))}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+        await asyncio.sleep(delay * len(words))
+        choice = {"message": {"content": "".join(words)}} if chat else {"text": "".join(words)}
+        return {"choices": [choice], **usage(body, len(words))}
+
+    @stub.post("/v1/chat/completions")
+    async def chat(request: Request):
+        return await respond(await request.json(), chat=True)
+
+    @stub.post("/v1/completions")
+    async def completions(request: Request):
+        return await respond(await request.json(), chat=False)
+
+    return stub
+
+
+class StubServer:
+    """Run an ASGI app with uvicorn on a free local port in a background thread."""
+
+    def __init__(self, app: FastAPI) -> None:
+        import uvicorn
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, name="stub-llama", daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Stub llama.cpp server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+async def bench_ask(
+    config: AppConfig, questions: Sequence[str], levels: Sequence[int], requests: int
+) -> List[Dict[str, Any]]:
+    from app.main import get_app
+
+    app = get_app(config=config)
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+            remaining = iter(questions)
+            for concurrency in levels:
+                semaphore = asyncio.Semaphore(concurrency)
+                latencies: List[float] = []
+                stages: Dict[str, List[float]] = defaultdict(list)
+                errors = 0
+
+                async def one(question: str) -> None:
+                    nonlocal errors
+                    async with semaphore:
+                        started = time.perf_counter()
+                        resp = await client.post("/ask", json={"question": question, "timings": True})
+                        latencies.append(time.perf_counter() - started)
+                    if resp.status_code != 200:
+                        errors += 1
+                        return
+                    for stage, value in (resp.json().get("timings") or {}).items():
+                        if stage.endswith("_ms"):
+                            stages[stage].append(value)
+
+                batch = [next(remaining) for _ in range(requests)]
+                started = time.perf_counter()
+                await asyncio.gather(*(one(question) for question in batch))
+                wall = time.perf_counter() - started
+                results.append(
+                    {
+                        "concurrency": concurrency,
+                        "requests": requests,
+                        "errors": errors,
+                        "requests_per_second": round(requests / wall, 2),
+                        **percentiles(latencies),
+                        "server_stages_mean_ms": {
+                            stage: round(float(np.mean(values)), 3) for stage, values in sorted(stages.items())
+                        },
+                    }
+                )
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=pathlib.Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run_benchmark(config: AppConfig, args: argparse.Namespace, workdir: pathlib.Path) -> Dict[str, Any]:
+    corpus_dir = workdir / "corpus"
+    config.data.raw_dir = str(corpus_dir)
+    config.data.index_dir = str(workdir / "index")
+    config.data.incremental = False
+    # Every request must reach retrieval and the model, not the answer cache.
+    config.answer_cache.enabled = False
+
+    started = time.perf_counter()
+    corpus = CorpusGenerator(pathlib.Path(args.source)).write(corpus_dir, args.files, args.words_per_file, args.seed)
+    corpus["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Synthetic corpus: %d files, %d words", corpus["files"], corpus["words"])
+
+    levels = sorted(set(args.concurrency))
+    questions = make_questions(corpus_dir, len(levels) * (args.queries + args.ask_requests), args.seed)
+    retrieve_questions = questions[: len(levels) * args.queries]
+    ask_questions = questions[len(levels) * args.queries :]
+
+    pipeline = RAGPipeline(RAGConfig.from_app_config(config))
+    try:
+        ingest = bench_ingest(pipeline, corpus_dir, corpus)
+        logger.info("Ingest: %s chunks in %ss", ingest["chunks"], ingest["seconds"])
+        pipeline.prime()
+
+        async def retrieve_levels() -> List[Dict[str, Any]]:
+            results = []
+            for number, concurrency in enumerate(levels):
+                batch = retrieve_questions[number * args.queries : (number + 1) * args.queries]
+                results.append(await bench_retrieve(pipeline, batch, concurrency))
+                logger.info("Retrieve: %s", results[-1])
+            return results
+
+        retrieve = asyncio.run(retrieve_levels())
+    finally:
+        pipeline.close()
+
+    ask = None
+    if args.ask_requests:
+        stub = build_stub_llama(config.model.name, args.token_delay_ms, args.completion_tokens, max(levels))
+        with StubServer(stub) as server:
+            config.model.api_base = f"http://127.0.0.1:{server.port}/v1"
+            config.model.backends = []
+            config.model.parallel_slots = max(levels)
+            config.model.admission_queue_size = max(config.model.admission_queue_size, args.ask_requests)
+            ask = asyncio.run(bench_ask(config, ask_questions, levels, args.ask_requests))
+        for result in ask:
+            logger.info("Ask: %s", result)
+
+    return {
+        "benchmark": "bonsai-rag",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "embedding_model": config.embedding.model,
+            "embedding_backend": config.embedding.backend,
+            "embedding_quantized": config.embedding.quantized,
+            "device": config.embedding.device,
+            "chunker": config.retrieval.chunker,
+            "chunk_size": config.retrieval.chunk_size,
+            "chunk_overlap": config.retrieval.chunk_overlap,
+            "top_k": config.retrieval.k,
+            "hybrid": config.retrieval.hybrid,
+            "rerank": config.retrieval.rerank,
+            "vector_store": config.data.vector_store,
+            "vector_dtype": config.data.vector_dtype,
+            "ingest_workers": config.data.ingest_workers,
+        },
+        "corpus": corpus,
+        "ingest": ingest,
+        "retrieve": retrieve,
+        "ask": ask,
+        "stub": {"token_delay_ms": args.token_delay_ms, "completion_tokens": args.completion_tokens},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingest, retrieval and /ask on a synthetic corpus; prints JSON results."
+    )
+    parser.add_argument(
+        "--config",
+        type=pathlib.Path,
+        default=pathlib.Path("config.yaml"),
+        help="Path to config YAML to benchmark (default: config.yaml)",
+    )
+    parser.add_argument("--source", default="data/raw", help="Transcripts the synthetic corpus imitates")
+    parser.add_argument("--files", type=int, default=50, help="Synthetic files to generate (default: 50)")
+    parser.add_argument("--words-per-file", type=int, default=3000, help="Typical file length (default: 3000)")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus and question seed (default: 0)")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 4, 16],
+        help="Comma-separated concurrency levels (default: 1,4,16)",
+    )
+    parser.add_argument("--queries", type=int, default=200, help="retrieve calls per concurrency level (default: 200)")
+    parser.add_argument(
+        "--ask-requests", type=int, default=50, help="/ask calls per concurrency level; 0 skips (default: 50)"
+    )
+    parser.add_argument("--token-delay-ms", type=float, default=20.0, help="Stub llama.cpp per-token delay")
+    parser.add_argument("--completion-tokens", type=int, default=64, help="Tokens the stub generates per answer")
+    parser.add_argument("--chunk-size", type=int, help="Override retrieval.chunk_size")
+    parser.add_argument("--chunk-overlap", type=int, help="Override retrieval.chunk_overlap")
+    parser.add_argument("--top-k", type=int, help="Override retrieval.k")
+    parser.add_argument("--device", help="Override embedding.device")
+    parser.add_argument("--workdir", type=pathlib.Path, help="Keep the corpus and index here instead of a temp dir")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    if min(args.concurrency) < 1 or args.files < 1 or args.queries < 1 or args.ask_requests < 0:
+        parser.error("--files, --queries and --concurrency must be positive")
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(levelname)s %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    config = AppConfig.load(args.config)
+    for value, section, name in (
+        (args.chunk_size, config.retrieval, "chunk_size"),
+        (args.chunk_overlap, config.retrieval, "chunk_overlap"),
+        (args.top_k, config.retrieval, "k"),
+        (args.device, config.embedding, "device"),
+    ):
+        if value is not None:
+            setattr(section, name, value)
+
+    workdir = args.workdir or pathlib.Path(tempfile.mkdtemp(prefix="bonsai-bench-"))
+    try:
+        results = run_benchmark(config, args, workdir)
+    except ValueError as exc:
+        parser.error(str(exc))
+        return
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generic, Hashable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread-safe LRU mapping with an optional per-entry TTL and hit/miss counters. ``on_evict`` is
+    called (outside the lock) for entries pushed out by capacity, not for expired ones.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, V], None]] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, key: Hashable, count_miss: bool = True) -> Optional[V]:
+        """Look ``key`` up; pass ``count_miss=False`` when a miss falls through to a second lookup that records it."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0], now):
+                if entry is not None:
+                    del self._entries[key]
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: V) -> None:
+        if self.max_size <= 0:
+            return
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                old_key, (stored_at, old_value) = self._entries.popitem(last=False)
+                if not self._expired(stored_at, now):
+                    evicted.append((old_key, old_value))
+        if self.on_evict is not None:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """The live value for ``key``, without touching recency or the hit/miss counters."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[1] if entry is not None and not self._expired(entry[0], now) else None
+
+    def values(self) -> Iterator[V]:
+        """Snapshot of live values, most recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            live = [value for stored_at, value in self._entries.values() if not self._expired(stored_at, now)]
+        return reversed(live)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def items(self) -> List[Tuple[Hashable, V]]:
+        """Snapshot of live (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        return [(key, value) for key, (stored_at, value) in entries if not self._expired(stored_at, now)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def record(self, hit: bool) -> None:
+        """Count the outcome of a lookup made outside ``get``."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    sources: List[dict]
+    embedding: Optional[np.ndarray] = None
+
+
+class AnswerCache:
+    """
+    Answers keyed on the normalised question, optionally matched by embedding similarity.
+    Entries belong to one index generation; the cache empties itself when the index changes.
+    """
+
+    def __init__(
+        self, max_size: int, ttl_seconds: Optional[float], similarity_threshold: Optional[float] = None
+    ) -> None:
+        self._entries: LRUCache[CachedAnswer] = LRUCache(max_size, ttl_seconds, on_evict=self._matrix_changed)
+        self.similarity_threshold = similarity_threshold
+        # Stacked embeddings of the cached answers, rebuilt after writes, so a similarity lookup is one product.
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_entries: List[CachedAnswer] = []
+        self._matrix_stale = True
+        # Guards the generation, the reset on a new one, and the stacked matrix against concurrent handlers.
+        self._lock = threading.Lock()
+        self.similar_hits = 0
+        self.invalidations = 0
+        self._generation: Optional[int] = None
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+    def _sync_generation(self, generation: int) -> None:
+        # Called with ``_lock`` held.
+        if self._generation is None or generation > self._generation:
+            if self._generation is not None:
+                self._entries.clear()
+                self._matrix_changed()
+                self.invalidations += 1
+            self._generation = generation
+
+    def lookup(self, question: str, generation: int) -> Optional[CachedAnswer]:
+        """
+        Exact match on the normalised question. With similarity matching on, a miss is not counted
+        here: the caller follows up with ``lookup_similar``, which records the request's outcome.
+        """
+        with self._lock:
+            self._sync_generation(generation)
+        return self._entries.get(self.normalize(question), count_miss=not self.similarity_threshold)
+
+    def lookup_similar(self, embedding: Sequence[float], generation: int) -> Optional[CachedAnswer]:
+        """The closest cached question at or above ``similarity_threshold``, after ``lookup`` missed."""
+        if not self.similarity_threshold:
+            with self._lock:
+                self._sync_generation(generation)
+            return None
+
+        best = None
+        with self._lock:
+            self._sync_generation(generation)
+            matrix, entries = self._similarity_matrix()
+        if matrix is not None:
+            # Embeddings are L2-normalised, so the dot products are cosine similarities.
+            scores = matrix @ np.asarray(embedding, dtype=np.float32)
+            for position in np.argsort(-scores):
+                if scores[position] < self.similarity_threshold:
+                    break
+                entry = entries[position]
+                # The matrix may still hold answers that have since expired or been replaced.
+                if self._entries.peek(self.normalize(entry.question)) is entry:
+                    best = entry
+                    break
+        if best is not None:
+            self.similar_hits += 1
+        self._entries.record(best is not None)
+        return best
+
+    def store(
+        self,
+        question: str,
+        generation: int,
+        answer: str,
+        sources: Sequence[dict],
+        embedding: Optional[Sequence[float]] = None,
+    ) -> None:
+        entry = CachedAnswer(
+            question=question,
+            answer=answer,
+            sources=[dict(source) for source in sources],
+            embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+        )
+        with self._lock:
+            self._sync_generation(generation)
+            if generation != self._generation:
+                # Generated against an index that has since been rebuilt.
+                return
+            self._entries.put(self.normalize(question), entry)
+            self._matrix_changed()
+
+    def _matrix_changed(self, *_: Any) -> None:
+        self._matrix_stale = True
+
+    def _similarity_matrix(self) -> Tuple[Optional[np.ndarray], List[CachedAnswer]]:
+        # Called with ``_lock`` held, so the matrix is stacked from entries of a single generation.
+        if self._matrix_stale:
+            self._matrix_stale = False
+            entries = [entry for entry in self._entries.values() if entry.embedding is not None]
+            self._matrix = np.stack([entry.embedding for entry in entries]) if entries else None
+            self._matrix_entries = entries
+        return self._matrix, self._matrix_entries
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._entries.stats(),
+            "similar_hits": self.similar_hits,
+            "invalidations": self.invalidations,
+            "generation": self._generation,
+        }
@@ -0,0 +1,237 @@
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+CHUNKERS = ("structured", "words")
+
+# Special tokens ([CLS], [SEP]) the embedding model adds around every chunk.
+SPECIAL_TOKENS = 2
+
+# Boundary strength before a unit: a heading always starts a new chunk, and chunks prefer to end on paragraphs.
+SENTENCE, PARAGRAPH, HEADING = 0, 1, 2
+
+# One pass over the text finds every boundary. Alternatives are tried in order at each position, so a blank
+# line wins over the sentence gap that starts at the same place.
+_BOUNDARY = re.compile(
+    r"(?P<heading>^[ \t]{0,3}#{1,6}[ \t]+(?P<title>[^\n]*?)[ \t#]*$)"
+    r"|(?P<paragraph>[ \t]*\n[ \t]*\n(?:[ \t]*\n)*)"
+    r"|(?P<sentence>(?:(?<=[.!?])|(?<=[.!?][\"'”’)\]]))\s+(?=[^\sa-z]))"
+    r"|(?P<line>[ \t]*\n)",
+    re.MULTILINE,
+)
+# Stand-in for the model tokenizer when it cannot be loaded: words and punctuation marks.
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class Chunk(NamedTuple):
+    text: str
+    # Character offsets into the source file; only set when ``text`` is an exact slice of it.
+    start: Optional[int] = None
+    end: Optional[int] = None
+    section: Optional[str] = None
+
+    def metadata(self) -> Dict[str, Any]:
+        fields = {"start": self.start, "end": self.end, "section": self.section}
+        return {key: value for key, value in fields.items() if value is not None}
+
+
+class _Unit(NamedTuple):
+    start: int
+    end: int
+    boundary: int
+    section: Optional[str]
+
+
+@lru_cache(maxsize=4)
+def _load_tokenizer(path: str) -> "Tokenizer":
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(path)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def model_max_tokens(path: Optional[str]) -> Optional[int]:
+    """The embedding model's input limit, as configured in its tokenizer.json (None if it does not say)."""
+    if path is None:
+        return None
+    from tokenizers import Tokenizer
+
+    truncation = Tokenizer.from_file(path).truncation
+    return truncation["max_length"] if truncation else None
+
+
+def chunk_words(text: str, chunk_size: int, chunk_overlap: int) -> List[Chunk]:
+    """Fixed windows of ``chunk_size`` whitespace-separated words, whitespace collapsed."""
+    words = text.split()
+    chunks: List[Chunk] = []
+    start = 0
+    while start < len(words):
+        end = min(len(words), start + chunk_size)
+        chunks.append(Chunk(" ".join(words[start:end])))
+        if end >= len(words):
+            break
+        start = max(0, end - chunk_overlap)
+    return chunks
+
+
+@dataclass
+class Chunker:
+    """
+    Split a document into chunks of at most ``chunk_size`` units. For "structured" the unit is an
+    embedding-model token and chunks end on sentence, paragraph or Markdown heading boundaries; for
+    "words" it is a whitespace-separated word. Plain fields only, so it can be sent to ingest worker
+    processes; each process loads the tokenizer once.
+    """
+
+    kind: str
+    chunk_size: int
+    chunk_overlap: int
+    # tokenizer.json of the embedding model; without it token counts are approximated.
+    tokenizer_path: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if self.kind not in CHUNKERS:
+            raise ValueError(f"Unknown chunker '{self.kind}' (expected 'structured' or 'words')")
+        if self.chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if self.chunk_overlap < 0:
+            raise ValueError("chunk_overlap must be non-negative")
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size to avoid infinite loops")
+
+    def __call__(self, text: str) -> List[Chunk]:
+        if self.kind == "words":
+            return chunk_words(text, self.chunk_size, self.chunk_overlap)
+        return self._chunk_structured(text)
+
+    def token_starts(self, text: str) -> np.ndarray:
+        """Character offset of every token in ``text``: the offset table all sizing is done against."""
+        if self.tokenizer_path is None:
+            return np.fromiter((match.start() for match in _APPROX_TOKEN.finditer(text)), dtype=np.int64)
+        encoding = _load_tokenizer(self.tokenizer_path).encode(text, add_special_tokens=False)
+        return np.fromiter((start for start, _ in encoding.offsets), dtype=np.int64)
+
+    def _chunk_structured(self, text: str) -> List[Chunk]:
+        units = _split_units(text)
+        if not units:
+            return []
+        starts = self.token_starts(text)
+        bounds = np.array([(unit.start, unit.end) for unit in units], dtype=np.int64)
+        tokens = np.searchsorted(starts, bounds[:, 1]) - np.searchsorted(starts, bounds[:, 0])
+        # cumulative[j] - cumulative[i] is the token count of units i..j-1.
+        cumulative = np.concatenate(([0], np.cumsum(tokens))).tolist()
+        size, overlap = self.chunk_size, self.chunk_overlap
+
+        chunks: List[Chunk] = []
+        first = 0
+        while first < len(units):
+            last = first
+            while (
+                last < len(units)
+                and (last == first or units[last].boundary != HEADING)
+                and cumulative[last + 1] - cumulative[first] <= size
+            ):
+                last += 1
+            if last == first:
+                # A single sentence longer than a chunk (e.g. an unpunctuated transcript).
+                chunks.extend(self._split_long(text, units[first], starts))
+                first += 1
+                continue
+            if last < len(units) and units[last].boundary == SENTENCE:
+                # Rather end on an earlier paragraph break, as long as the chunk stays at least half full.
+                for candidate in range(last - 1, first, -1):
+                    if cumulative[candidate] - cumulative[first] < size // 2:
+                        break
+                    if units[candidate].boundary == PARAGRAPH:
+                        last = candidate
+                        break
+            start, end = units[first].start, units[last - 1].end
+            chunks.append(Chunk(text[start:end], start, end, units[first].section))
+            if last >= len(units):
+                break
+            # Repeat whole trailing sentences, up to chunk_overlap tokens, but never across a heading.
+            following = last
+            if units[last].boundary != HEADING:
+                while following - 1 > first and cumulative[last] - cumulative[following - 1] <= overlap:
+                    following -= 1
+            first = following
+        return chunks
+
+    def _split_long(self, text: str, unit: _Unit, starts: np.ndarray) -> List[Chunk]:
+        """Cut one oversized unit into token windows, moving each cut back to the start of a word."""
+        lo, hi = (int(index) for index in np.searchsorted(starts, [unit.start, unit.end]))
+        size, overlap = self.chunk_size, self.chunk_overlap
+        chunks: List[Chunk] = []
+        first = lo
+        while first < hi:
+            last = min(first + size, hi)
+            if last < hi:
+                for candidate in range(last, first + size // 2, -1):
+                    if _after_space(text, starts[candidate]):
+                        last = candidate
+                        break
+            start = unit.start if first == lo else int(starts[first])
+            end = unit.end if last >= hi else int(starts[last])
+            start, end = _strip(text, start, end)
+            if end > start:
+                chunks.append(Chunk(text[start:end], start, end, unit.section))
+            if last >= hi:
+                break
+            following = max(last - overlap, first + 1)
+            while following < last and not _after_space(text, starts[following]):
+                following += 1
+            first = following
+        return chunks
+
+
+def _after_space(text: str, offset: int) -> bool:
+    # Several tokens can start at offset 0 (e.g. the bytes of one character); text[-1] would be the end of the text.
+    return offset > 0 and text[offset - 1].isspace()
+
+
+def _strip(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _split_units(text: str) -> List[_Unit]:
+    """Sentences, lines and headings of ``text`` as offsets, each tagged with the boundary before it."""
+    units: List[_Unit] = []
+    section: Optional[str] = None
+    position = 0
+    boundary = PARAGRAPH
+
+    def add(start: int, end: int, kind: int) -> bool:
+        start, end = _strip(text, start, end)
+        if end > start:
+            units.append(_Unit(start, end, kind, section))
+            return True
+        return False
+
+    for match in _BOUNDARY.finditer(text):
+        added = add(position, match.start(), boundary)
+        position = match.end()
+        if match.group("heading") is not None:
+            section = match.group("title").strip() or section
+            add(match.start(), match.end(), HEADING)
+            boundary = SENTENCE
+        else:
+            found = PARAGRAPH if match.group("paragraph") is not None else SENTENCE
+            # Nothing between two boundaries (e.g. a sentence end right before a blank line): keep the stronger.
+            boundary = found if added else max(boundary, found)
+    add(position, len(text), boundary)
+    return units
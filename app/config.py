@@ -1,11 +1,17 @@
 import os
 import pathlib
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 
 import yaml
 
 
+@dataclass
+class BackendSettings:
+    api_base: str
+    max_concurrency: Optional[int] = None
+
+
 @dataclass
 class ModelSettings:
     path: str
@@ -15,12 +21,38 @@ class ModelSettings:
     temperature: float = 0.7
     timeout_seconds: int = 120
     name: str = "local-llm"
+    cache_prompt: bool = True
+    slot_affinity: bool = False
+    parallel_slots: int = 1
+    context_window: int = 4096
+    endpoint: str = "auto"
+    endpoint_reprobe_seconds: float = 300.0
+    max_connections: int = 32
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    backends: List[BackendSettings] = field(default_factory=list)
+    admission_queue_size: int = 64
+    admission_timeout_seconds: float = 30.0
+    health_check_seconds: float = 5.0
+
+    def __post_init__(self) -> None:
+        # YAML gives plain URLs or mappings; normalise both.
+        backends = []
+        for backend in self.backends or []:
+            if isinstance(backend, str):
+                backend = BackendSettings(api_base=backend)
+            elif isinstance(backend, dict):
+                backend = BackendSettings(**backend)
+            backends.append(backend)
+        self.backends = backends
 
 
 @dataclass
 class ServerSettings:
     host: str
     port: int
+    lazy_startup: bool = True
 
 
 @dataclass
@@ -35,6 +67,11 @@ class EmbeddingSettings:
     device: str
     cache_dir: Optional[str] = None
     local_files_only: bool = False
+    batch_size: int = 64
+    backend: str = "sentence-transformers"
+    onnx_path: Optional[str] = None
+    quantized: bool = False
+    threads: int = 0
 
 
 @dataclass
@@ -42,12 +79,53 @@ class RetrievalSettings:
     k: int
     chunk_size: int
     chunk_overlap: int
+    chunker: str = "structured"
+    query_workers: int = 16
+    query_batch_max_size: int = 16
+    query_batch_max_wait_ms: float = 5.0
+    embedding_cache_size: int = 1024
+    result_cache_size: int = 512
+    pack_context: bool = True
+    context_token_budget: Optional[int] = None
+    hybrid: bool = True
+    lexical_candidates: int = 20
+    rrf_k: int = 60
+    rerank: str = "none"
+    rerank_candidates: int = 20
+    rerank_budget_ms: Optional[float] = 150.0
+    mmr_diversity: float = 0.3
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 
 @dataclass
 class DataSettings:
     raw_dir: str
     index_dir: str
+    incremental: bool = True
+    vector_store: str = "chroma"
+    vector_dtype: str = "float32"
+    ingest_workers: int = 0
+    ingest_queue_size: int = 16
+    index_gc_grace_seconds: float = 30.0
+
+
+@dataclass
+class AnswerCacheSettings:
+    enabled: bool = True
+    max_entries: int = 256
+    ttl_seconds: Optional[float] = 3600
+    similarity_threshold: Optional[float] = None
+
+
+@dataclass
+class SessionSettings:
+    enabled: bool = True
+    max_sessions: int = 1000
+    ttl_seconds: Optional[float] = 3600
+    max_turns: int = 20
+    history_token_budget: int = 1024
+    follow_up_threshold: Optional[float] = 0.85
+    spill_dir: Optional[str] = None
 
 
 @dataclass
@@ -58,6 +136,8 @@ class AppConfig:
     embedding: EmbeddingSettings
     retrieval: RetrievalSettings
     data: DataSettings
+    answer_cache: AnswerCacheSettings = field(default_factory=AnswerCacheSettings)
+    sessions: SessionSettings = field(default_factory=SessionSettings)
 
     @classmethod
     def _coerce(cls, data: Dict[str, Any]) -> "AppConfig":
@@ -68,6 +148,8 @@ class AppConfig:
             embedding=EmbeddingSettings(**data["embedding"]),
             retrieval=RetrievalSettings(**data["retrieval"]),
             data=DataSettings(**data["data"]),
+            answer_cache=AnswerCacheSettings(**(data.get("answer_cache") or {})),
+            sessions=SessionSettings(**(data.get("sessions") or {})),
         )
 
     @classmethod
@@ -0,0 +1,103 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.llm import LlamaTokenCounter
+
+logger = logging.getLogger(__name__)
+
+# Tokens reserved for the chat template, role markers and the "Context:/Question:/Answer:" scaffolding.
+TEMPLATE_OVERHEAD_TOKENS = 32
+
+
+def chunk_position(hit: dict) -> Tuple[str, int]:
+    _, _, idx = str(hit.get("id", "")).rpartition("::")
+    return hit.get("source", ""), int(idx) if idx.isdigit() else -1
+
+
+def merge_neighbours(hits: Sequence[dict], chunk_overlap: int) -> List[dict]:
+    """
+    Drop duplicate chunks and merge consecutive chunks of the same source into one block,
+    removing the text the second chunk repeats: located by character offsets when the chunks
+    carry them, otherwise assumed to be ``chunk_overlap`` words. Blocks keep the rank of
+    their best-ranked member.
+    """
+    ranked: Dict[str, Tuple[int, dict]] = {}
+    for rank, hit in enumerate(hits):
+        ranked.setdefault(str(hit.get("id", rank)), (rank, hit))
+
+    blocks: List[Tuple[int, dict]] = []
+    previous: Optional[dict] = None
+    for rank, hit in sorted(ranked.values(), key=lambda item: chunk_position(item[1])):
+        source, idx = chunk_position(hit)
+        if previous is not None and idx >= 0 and previous["source"] == source and previous["_last"] == idx - 1:
+            if previous.get("end") is not None and hit.get("start") is not None:
+                repeated = max(previous["end"] - hit["start"], 0)
+                tail = hit["text"][repeated:]
+                previous["text"] += tail if repeated else " " + tail
+                previous["end"] = max(previous["end"], hit.get("end", previous["end"]))
+            else:
+                tail = hit["text"].split()[chunk_overlap:]
+                previous["text"] = " ".join([previous["text"], *tail]) if tail else previous["text"]
+            previous["_last"] = idx
+            blocks[-1] = (min(blocks[-1][0], rank), previous)
+            continue
+        previous = {**hit, "_last": idx}
+        blocks.append((rank, previous))
+
+    merged = []
+    for _, block in sorted(blocks, key=lambda item: item[0]):
+        block.pop("_last", None)
+        merged.append(block)
+    return merged
+
+
+class ContextPacker:
+    """Select retrieved context that fits a prompt token budget, most relevant first."""
+
+    def __init__(
+        self,
+        counter: LlamaTokenCounter,
+        context_window: int,
+        max_tokens: int,
+        chunk_overlap: int,
+        system_prompt: str,
+        budget_tokens: Optional[int] = None,
+    ) -> None:
+        self.counter = counter
+        self.context_window = context_window
+        self.max_tokens = max_tokens
+        self.chunk_overlap = chunk_overlap
+        self.system_prompt = system_prompt
+        self.budget_tokens = budget_tokens
+
+    async def budget(self, question: str, client: Optional[httpx.AsyncClient], reserved_tokens: int = 0) -> int:
+        """Context tokens available; ``reserved_tokens`` is taken by other prompt parts such as history."""
+        if self.budget_tokens is not None:
+            # An explicit budget covers history too, so a long conversation cannot push the prompt past the window.
+            return max(self.budget_tokens - reserved_tokens, 0)
+        reserved = (
+            reserved_tokens
+            + self.max_tokens
+            + await self.counter.count(self.system_prompt, client)
+            + await self.counter.count(question, client)
+            + TEMPLATE_OVERHEAD_TOKENS
+        )
+        return max(self.context_window - reserved, 0)
+
+    async def pack(
+        self, question: str, hits: Sequence[dict], client: Optional[httpx.AsyncClient], reserved_tokens: int = 0
+    ) -> List[dict]:
+        budget = await self.budget(question, client, reserved_tokens)
+        packed: List[dict] = []
+        used = 0
+        for block in merge_neighbours(hits, self.chunk_overlap):
+            cost = await self.counter.count(f"Source: {block['source']}\n{block['text']}\n\n", client)
+            if used + cost > budget:
+                logger.debug("Skipping %s (%d tokens): %d/%d context tokens used", block.get("id"), cost, used, budget)
+                continue
+            packed.append(block)
+            used += cost
+        logger.debug("Packed %d of %d hits into %d/%d context tokens", len(packed), len(hits), used, budget)
+        return packed
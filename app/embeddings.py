@@ -0,0 +1,169 @@
+import json
+import logging
+import pathlib
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import onnxruntime
+    from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "onnx/model.onnx"
+QUANTIZED_MODEL_NAME = "model_quantized.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+POOLING_CONFIG_FILE = "1_Pooling/config.json"
+
+
+def embedding_variant(backend: str, quantized: bool) -> str:
+    """Name of the vector space a backend produces; ONNX fp32 matches the PyTorch model to float precision."""
+    if backend not in {"sentence-transformers", "onnx"}:
+        raise ValueError(f"Unknown embedding backend '{backend}' (expected 'sentence-transformers' or 'onnx')")
+    return "int8" if backend == "onnx" and quantized else "fp32"
+
+
+def _resolve_files(
+    model_name: str, onnx_path: Optional[str], cache_dir: Optional[str], local_files_only: bool
+) -> Tuple[pathlib.Path, pathlib.Path, Optional[pathlib.Path]]:
+    """Locate (model.onnx, tokenizer.json, pooling config) for ``model_name``."""
+    if onnx_path:
+        model_file = pathlib.Path(onnx_path)
+        if model_file.is_dir():
+            model_file = model_file / "model.onnx"
+        root = model_file.parent
+        # Sentence-transformers checkpoints keep the export in an onnx/ subfolder next to the tokenizer.
+        if not (root / TOKENIZER_FILE).exists() and (root.parent / TOKENIZER_FILE).exists():
+            root = root.parent
+        pooling = root / POOLING_CONFIG_FILE
+        return model_file, root / TOKENIZER_FILE, pooling if pooling.exists() else None
+
+    local = pathlib.Path(model_name)
+    if local.is_dir():
+        pooling = local / POOLING_CONFIG_FILE
+        return local / ONNX_MODEL_FILE, local / TOKENIZER_FILE, pooling if pooling.exists() else None
+
+    from huggingface_hub import hf_hub_download
+
+    def download(filename: str) -> pathlib.Path:
+        return pathlib.Path(
+            hf_hub_download(model_name, filename, cache_dir=cache_dir, local_files_only=local_files_only)
+        )
+
+    try:
+        pooling = download(POOLING_CONFIG_FILE)
+    except Exception:  # pragma: no cover - plain transformers checkpoints have no pooling config
+        pooling = None
+    return download(ONNX_MODEL_FILE), download(TOKENIZER_FILE), pooling
+
+
+def tokenizer_file(
+    model_name: str, onnx_path: Optional[str], cache_dir: Optional[str], local_files_only: bool
+) -> pathlib.Path:
+    """Locate the tokenizer.json of ``model_name``, or of the ONNX export at ``onnx_path`` when given."""
+    if onnx_path:
+        return _resolve_files(model_name, onnx_path, cache_dir, local_files_only)[1]
+    local = pathlib.Path(model_name)
+    if local.is_dir():
+        return local / TOKENIZER_FILE
+    from huggingface_hub import hf_hub_download
+
+    return pathlib.Path(
+        hf_hub_download(model_name, TOKENIZER_FILE, cache_dir=cache_dir, local_files_only=local_files_only)
+    )
+
+
+def _pooling_mode(path: Optional[pathlib.Path]) -> str:
+    if path is None:
+        return "cls"
+    with path.open("r", encoding="utf-8") as handle:
+        config = json.load(handle)
+    if config.get("pooling_mode_mean_tokens"):
+        return "mean"
+    if config.get("pooling_mode_cls_token"):
+        return "cls"
+    raise ValueError(f"Unsupported pooling config in {path}; only CLS and mean pooling are implemented")
+
+
+def _quantized_model(model_file: pathlib.Path) -> pathlib.Path:
+    """Return an int8 copy of ``model_file``, quantising it once and caching it next to the original."""
+    target = model_file.with_name(QUANTIZED_MODEL_NAME)
+    if target.exists():
+        return target
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info("Quantising %s to int8 (one-off) -> %s", model_file, target)
+    tmp = target.with_suffix(".tmp.onnx")
+    quantize_dynamic(str(model_file), str(tmp), weight_type=QuantType.QInt8)
+    tmp.replace(target)
+    return target
+
+
+class OnnxEmbedding:
+    """Embed with an exported ONNX model on onnxruntime's CPU provider, without importing torch."""
+
+    def __init__(
+        self,
+        model_name: str,
+        onnx_path: Optional[str],
+        cache_dir: Optional[pathlib.Path],
+        local_files_only: bool,
+        quantized: bool = False,
+        threads: int = 0,
+        batch_size: int = 32,
+        max_length: int = 512,
+    ) -> None:
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        cache_dir_str = str(cache_dir) if cache_dir else None
+        try:
+            model_file, tokenizer_file, pooling_file = _resolve_files(
+                model_name, onnx_path, cache_dir_str, local_files_only
+            )
+            if quantized:
+                model_file = _quantized_model(model_file)
+        except Exception as exc:  # pragma: no cover - runtime guardrail
+            hint = (
+                f"Failed to locate an ONNX export of '{model_name}'. Set embedding.onnx_path to a folder "
+                f"containing model.onnx and tokenizer.json. cache_dir={cache_dir_str or 'default cache'}"
+            )
+            raise RuntimeError(hint) from exc
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        logger.info("Loading ONNX embedding model %s (threads=%s)", model_file, threads or "auto")
+        self.session: "onnxruntime.InferenceSession" = onnxruntime.InferenceSession(
+            str(model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {item.name for item in self.session.get_inputs()}
+        self.tokenizer: "Tokenizer" = Tokenizer.from_file(str(tokenizer_file))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.pooling = _pooling_mode(pooling_file)
+        self.batch_size = batch_size
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        if self.pooling == "mean":
+            mask = attention_mask[..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        else:
+            pooled = hidden[:, 0]
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def __call__(self, input: Sequence[str]) -> List[List[float]]:
+        texts = list(input)
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._encode(texts[start : start + self.batch_size]).tolist())
+        return embeddings
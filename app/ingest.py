@@ -5,22 +5,12 @@ from app.config import AppConfig
 from app.rag import RAGConfig, RAGPipeline
 
 
-def run_ingest(config_path: pathlib.Path) -> int:
+def run_ingest(config_path: pathlib.Path, full: bool = False) -> int:
     config = AppConfig.load(config_path)
     config.ensure_data_dirs()
 
-    rag_config = RAGConfig(
-        index_dir=pathlib.Path(config.data.index_dir),
-        embedding_model=config.embedding.model,
-        device=config.embedding.device,
-        chunk_size=config.retrieval.chunk_size,
-        chunk_overlap=config.retrieval.chunk_overlap,
-        top_k=config.retrieval.k,
-        cache_dir=pathlib.Path(config.embedding.cache_dir) if config.embedding.cache_dir else None,
-        local_files_only=config.embedding.local_files_only,
-    )
-    pipeline = RAGPipeline(rag_config)
-    return pipeline.rebuild(pathlib.Path(config.data.raw_dir))
+    pipeline = RAGPipeline(RAGConfig.from_app_config(config))
+    return pipeline.rebuild(pathlib.Path(config.data.raw_dir), incremental=config.data.incremental and not full)
 
 
 def main() -> None:
@@ -31,10 +21,15 @@ def main() -> None:
         default=pathlib.Path("config.yaml"),
         help="Path to config YAML (default: config.yaml)",
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-embed every file into a new index version and swap it in, ignoring the ingest manifest",
+    )
     args = parser.parse_args()
 
     try:
-        count = run_ingest(args.config)
+        count = run_ingest(args.config, full=args.full)
     except ValueError as exc:
         parser.error(str(exc))
         return
@@ -0,0 +1,142 @@
+import json
+import logging
+import pathlib
+import re
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app import utils
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_DIR = "lexical"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by do for from has have how i if in into is it its of on or so that the "
+    "then there these they this to was we what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def document_text(source: str, text: str) -> str:
+    # Index the file name too: transcripts are titled by species / technique ("Dothistroma Identification").
+    return f"{pathlib.PurePath(source).stem} {text}"
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index persisted as flat NumPy arrays: a vocabulary of term -> (offset,
+    document frequency), and posting lists of (chunk number, term frequency) that are
+    memory-mapped on first search. Each build goes into a fresh directory under ``root``
+    named by ``root/CURRENT``, so readers of the previous build keep working (and Windows
+    can keep its files mapped) while a new one is written.
+    """
+
+    def __init__(self, directory: pathlib.Path, k1: float = 1.2, b: float = 0.75) -> None:
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = Lock()
+        self._loaded = False
+        self._ids: List[str] = []
+        self._vocab: Dict[str, Tuple[int, int]] = {}
+        self._postings_doc: Optional[np.ndarray] = None
+        self._postings_tf: Optional[np.ndarray] = None
+        self._doc_len: Optional[np.ndarray] = None
+        self._avgdl = 0.0
+
+    @classmethod
+    def open(cls, root: pathlib.Path) -> Optional["LexicalIndex"]:
+        directory = utils.current_version(root)
+        return cls(directory) if directory is not None and (directory / "meta.json").exists() else None
+
+    @classmethod
+    def build(cls, root: pathlib.Path, documents: Iterable[Tuple[str, str, str]]) -> "LexicalIndex":
+        """Write an index for ``(chunk id, source, text)`` triples and make it current."""
+        ids: List[str] = []
+        doc_len: List[int] = []
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for chunk_id, source, text in documents:
+            number = len(ids)
+            terms = Counter(tokenize(document_text(source, text)))
+            ids.append(chunk_id)
+            doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings[term].append((number, tf))
+
+        vocab: Dict[str, Tuple[int, int]] = {}
+        docs: List[int] = []
+        tfs: List[int] = []
+        for term in sorted(postings):
+            entries = postings[term]
+            vocab[term] = (len(docs), len(entries))
+            docs.extend(number for number, _ in entries)
+            tfs.extend(min(tf, 65535) for _, tf in entries)
+
+        directory = utils.new_version_dir(root)
+        np.save(directory / "postings_doc.npy", np.asarray(docs, dtype=np.int32))
+        np.save(directory / "postings_tf.npy", np.asarray(tfs, dtype=np.uint16))
+        np.save(directory / "doc_len.npy", np.asarray(doc_len, dtype=np.int32))
+        with (directory / "vocab.json").open("w", encoding="utf-8") as handle:
+            json.dump(vocab, handle)
+        with (directory / "meta.json").open("w", encoding="utf-8") as handle:
+            json.dump({"ids": ids}, handle)
+
+        utils.publish_version(root, directory)
+        logger.info("Built lexical index: %d chunks, %d terms, %d postings", len(ids), len(vocab), len(docs))
+        return cls(directory)
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            with (self.directory / "meta.json").open("r", encoding="utf-8") as handle:
+                self._ids = json.load(handle)["ids"]
+            with (self.directory / "vocab.json").open("r", encoding="utf-8") as handle:
+                self._vocab = {term: tuple(entry) for term, entry in json.load(handle).items()}
+            self._postings_doc = np.load(self.directory / "postings_doc.npy", mmap_mode="r")
+            self._postings_tf = np.load(self.directory / "postings_tf.npy", mmap_mode="r")
+            self._doc_len = np.load(self.directory / "doc_len.npy", mmap_mode="r")
+            self._avgdl = float(self._doc_len.mean()) if len(self._doc_len) else 0.0
+            self._loaded = True
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        self._load()
+        if not self._ids or n_results <= 0:
+            return []
+        total = len(self._ids)
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len / max(self._avgdl, 1e-9))
+        scores = np.zeros(total, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self._vocab.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            docs = self._postings_doc[offset : offset + df]
+            tf = self._postings_tf[offset : offset + df].astype(np.float32)
+            idf = np.log(1.0 + (total - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > n_results:
+            matched = matched[np.argpartition(scores[matched], -n_results)[-n_results:]]
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self._ids[number], float(scores[number])) for number in ranked]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Fuse ranked id lists: score(id) = sum(1 / (k + rank)), best first."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda chunk_id: -scores[chunk_id])
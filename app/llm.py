@@ -1,13 +1,77 @@
+import json
 import logging
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
 
 import httpx
 from fastapi import HTTPException
 
+from app import metrics
+from app.cache import LRUCache
+
 logger = logging.getLogger(__name__)
 
 
+def server_root(api_base: str) -> str:
+    """llama-server's native endpoints (/tokenize, /health, /slots) live beside the /v1 API."""
+    base = api_base.rstrip("/")
+    return base[: -len("/v1")] if base.endswith("/v1") else base
+
+
+def _extract_chat(payload: Dict[str, Any]) -> Optional[str]:
+    return payload.get("choices", [{}])[0].get("message", {}).get("content")
+
+
+def _extract_completion(payload: Dict[str, Any]) -> Optional[str]:
+    return payload.get("choices", [{}])[0].get("text")
+
+
+def _extract_chat_delta(payload: Dict[str, Any]) -> Optional[str]:
+    return (payload.get("choices") or [{}])[0].get("delta", {}).get("content")
+
+
+def _extract_completion_delta(payload: Dict[str, Any]) -> Optional[str]:
+    return (payload.get("choices") or [{}])[0].get("text")
+
+
+def _record_stats(payload: Dict[str, Any]) -> None:
+    """Record token counts and server-side timings from llama-server's ``usage`` / ``timings`` fields."""
+    usage = payload.get("usage") or {}
+    timings = payload.get("timings") or {}
+    metrics.record_usage(
+        usage.get("prompt_tokens", timings.get("prompt_n")),
+        usage.get("completion_tokens", timings.get("predicted_n")),
+    )
+    for phase, key in (("prompt_eval", "prompt_ms"), ("decode", "predicted_ms")):
+        if key in timings:
+            metrics.LLM_SERVER_SECONDS.observe(timings[key] / 1000.0, phase=phase)
+
+
+async def _iter_sse(resp: httpx.Response, extract: Callable[[Dict[str, Any]], Optional[str]]) -> AsyncIterator[str]:
+    stats: Optional[Dict[str, Any]] = None
+    async for line in resp.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            break
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            logger.debug("Skipping non-JSON stream line: %s", data)
+            continue
+        # The final chunk carries the run's timings (and usage, on builds that send it).
+        if "timings" in payload or payload.get("usage"):
+            stats = payload
+        text = extract(payload)
+        if text:
+            yield text
+    if stats is not None:
+        _record_stats(stats)
+
+
 @dataclass
 class LlamaCPPClient:
     api_base: str
@@ -15,65 +79,177 @@ class LlamaCPPClient:
     max_tokens: int
     temperature: float
     timeout_seconds: int = 120
+    system_prompt: str = "You are a helpful bonsai assistant."
+    cache_prompt: bool = False
+    slot_affinity: bool = False
+    parallel_slots: int = 1
+    # "auto" probes /chat/completions and remembers whether it works; "chat" tries it on every
+    # request (falling back per request); "completions" never calls it.
+    endpoint: str = "auto"
+    # The server's real slot count, read from /slots by the backend health check; parallel_slots until then.
+    slot_count: Optional[int] = field(default=None, init=False)
+    _mode: Optional[str] = field(default=None, init=False, repr=False)
+
+    @property
+    def active_endpoint(self) -> Optional[str]:
+        """The completion endpoint requests go to: "chat", "completions", or None while undecided."""
+        return self.endpoint if self.endpoint != "auto" else self._mode
+
+    def _chat_first(self) -> bool:
+        if self.endpoint != "auto":
+            return self.endpoint == "chat"
+        return self._mode != "completions"
 
-    async def generate(self, prompt: str, client: httpx.AsyncClient) -> str:
-        chat_body = {
+    def _remember(self, mode: str) -> None:
+        if self.endpoint == "auto" and self._mode != mode:
+            path = "/chat/completions" if mode == "chat" else "/completions"
+            logger.info("Using llama.cpp %s for %s", path, self.api_base)
+            self._mode = mode
+
+    async def probe(self, client: httpx.AsyncClient) -> Optional[str]:
+        """Detect whether /chat/completions works with a one-token request; returns the endpoint in use."""
+        if self.endpoint != "auto":
+            return self.endpoint
+        body = {**self._chat_body("ping", stream=False), "max_tokens": 1, "cache_prompt": False}
+        try:
+            resp = await client.post(f"{self.api_base}/chat/completions", json=body)
+        except httpx.HTTPError as exc:
+            logger.debug("Endpoint probe failed (%s); deciding on the next request instead", exc)
+            return self._mode
+        if resp.status_code in (400, 404) and "model not found" not in resp.text.lower():
+            self._remember("completions")
+        elif resp.is_success:
+            try:
+                choices = resp.json().get("choices")
+            except ValueError:
+                choices = None
+            self._remember("chat" if choices else "completions")
+        return self._mode
+
+    def _cache_fields(self, session_id: Optional[str]) -> Dict[str, Any]:
+        """llama-server extensions: reuse the slot's KV cache and pin a session to one slot."""
+        fields: Dict[str, Any] = {}
+        if self.cache_prompt:
+            fields["cache_prompt"] = True
+        slots = self.slot_count or self.parallel_slots
+        if self.slot_affinity and session_id and slots > 1:
+            slot = zlib.crc32(session_id.encode("utf-8")) % slots
+            # Newer builds read id_slot; older ones read slot_id. Unknown fields are ignored.
+            fields["id_slot"] = slot
+            fields["slot_id"] = slot
+        return fields
+
+    def _chat_body(
+        self, prompt: str, stream: bool, session_id: Optional[str] = None, history: Sequence[Tuple[str, str]] = ()
+    ) -> Dict[str, Any]:
+        messages: List[Dict[str, str]] = [{"role": "system", "content": self.system_prompt}]
+        # Earlier turns go in as plain question/answer messages, so each turn's prompt extends the last.
+        for question, answer in history:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": prompt})
+        return {
             "model": self.model_name,
-            "messages": [
-                {"role": "system", "content": "You are a helpful bonsai assistant."},
-                {"role": "user", "content": prompt},
-            ],
+            "messages": messages,
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
-            "stream": False,
+            "stream": stream,
+            **self._cache_fields(session_id),
         }
 
-        completion_body = {
+    def _completion_body(
+        self, prompt: str, stream: bool, session_id: Optional[str] = None, history: Sequence[Tuple[str, str]] = ()
+    ) -> Dict[str, Any]:
+        turns = "".join(f"Question: {question}\nAnswer: {answer}\n\n" for question, answer in history)
+        return {
             "model": self.model_name,
-            "prompt": prompt,
+            "prompt": f"{self.system_prompt}\n\n{turns}{prompt}",
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
-            "stream": False,
+            "stream": stream,
+            **self._cache_fields(session_id),
         }
 
-        def _extract_chat(payload: Dict[str, Any]) -> Optional[str]:
-            return payload.get("choices", [{}])[0].get("message", {}).get("content")
+    def _chat_error(self, exc: httpx.HTTPStatusError) -> Optional[HTTPException]:
+        """Map a failed /chat/completions call to an HTTPException, or None to fall back to /completions."""
+        status_code, text = exc.response.status_code, exc.response.text
+        if status_code in (400, 404) and "model not found" in text.lower():
+            detail = (
+                "Model not found on llama.cpp. Start llama-server.exe with "
+                f"--model <path> --alias {self.model_name} --no-router "
+                "(or update config.model.name to the alias you use), and stop any router-mode server already running."
+            )
+            return HTTPException(status_code=400, detail=detail)
+        if status_code not in (400, 404):
+            return HTTPException(
+                status_code=status_code,
+                detail=f"Model call failed: {exc}. Response: {text}",
+            )
+        logger.warning(
+            "Chat completion failed with status %s. Retrying with /completions. Body: %s",
+            status_code,
+            text,
+        )
+        metrics.LLM_FALLBACKS.inc(reason=str(status_code))
+        return None
+
+    def _completion_error(self, exc: httpx.HTTPStatusError) -> HTTPException:
+        status_code, text = exc.response.status_code, exc.response.text
+        if status_code in (400, 404) and "model not found" in text.lower():
+            detail = (
+                "Model not found on llama.cpp (fallback). Start llama-server.exe with "
+                f"--model <path> --alias {self.model_name} --no-router "
+                "and keep config.model.name in sync; also stop any router-mode server already running."
+            )
+            return HTTPException(status_code=400, detail=detail)
+        return HTTPException(
+            status_code=status_code,
+            detail=f"Model call failed after fallback: {exc}. Response: {text}",
+        )
 
-        def _extract_completion(payload: Dict[str, Any]) -> Optional[str]:
-            return payload.get("choices", [{}])[0].get("text")
+    async def generate(
+        self,
+        prompt: str,
+        client: httpx.AsyncClient,
+        session_id: Optional[str] = None,
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> str:
+        with metrics.timed("llm_generation"):
+            return await self._generate(prompt, client, session_id, history)
 
-        try:
-            resp = await client.post(f"{self.api_base}/chat/completions", json=chat_body)
-            resp.raise_for_status()
-            data = resp.json()
-            content = _extract_chat(data)
-            if content:
-                return content
-            logger.warning("Chat completion payload missing content; retrying with /completions")
-        except httpx.HTTPStatusError as exc:
-            if exc.response.status_code in (400, 404) and "model not found" in exc.response.text.lower():
-                detail = (
-                    "Model not found on llama.cpp. Start llama-server.exe with "
-                    f"--model <path> --alias {self.model_name} --no-router "
-                    "(or update config.model.name to the alias you use), and stop any router-mode server already running."
+    async def _generate(
+        self, prompt: str, client: httpx.AsyncClient, session_id: Optional[str], history: Sequence[Tuple[str, str]]
+    ) -> str:
+        if self._chat_first():
+            try:
+                resp = await client.post(
+                    f"{self.api_base}/chat/completions",
+                    json=self._chat_body(prompt, stream=False, session_id=session_id, history=history),
                 )
-                raise HTTPException(status_code=400, detail=detail) from exc
-            if exc.response.status_code not in (400, 404):
-                raise HTTPException(
-                    status_code=exc.response.status_code,
-                    detail=f"Model call failed: {exc}. Response: {exc.response.text}",
-                ) from exc
-            logger.warning(
-                "Chat completion failed with status %s. Retrying with /completions. Body: %s",
-                exc.response.status_code,
-                exc.response.text,
-            )
-        except Exception as exc:  # pragma: no cover - runtime guardrail
-            raise HTTPException(status_code=500, detail=f"Model call failed: {exc}") from exc
+                resp.raise_for_status()
+                data = resp.json()
+                content = _extract_chat(data)
+                if content:
+                    _record_stats(data)
+                    self._remember("chat")
+                    return content
+                logger.warning("Chat completion payload missing content; retrying with /completions")
+                metrics.LLM_FALLBACKS.inc(reason="empty")
+                self._remember("completions")
+            except httpx.HTTPStatusError as exc:
+                error = self._chat_error(exc)
+                if error is not None:
+                    raise error from exc
+                self._remember("completions")
+            except Exception as exc:  # pragma: no cover - runtime guardrail
+                raise HTTPException(status_code=500, detail=f"Model call failed: {exc}") from exc
 
-        # Fallback to legacy /completions
+        # Fallback to legacy /completions (or the remembered choice on servers without chat support)
         try:
-            resp = await client.post(f"{self.api_base}/completions", json=completion_body)
+            resp = await client.post(
+                f"{self.api_base}/completions",
+                json=self._completion_body(prompt, stream=False, session_id=session_id, history=history),
+            )
             resp.raise_for_status()
             data = resp.json()
             content = _extract_completion(data)
@@ -82,18 +258,119 @@ class LlamaCPPClient:
                     status_code=500,
                     detail="Model returned an empty payload from /completions",
                 )
+            _record_stats(data)
             return content
         except httpx.HTTPStatusError as exc:
-            if exc.response.status_code in (400, 404) and "model not found" in exc.response.text.lower():
-                detail = (
-                    "Model not found on llama.cpp (fallback). Start llama-server.exe with "
-                    f"--model <path> --alias {self.model_name} --no-router "
-                    "and keep config.model.name in sync; also stop any router-mode server already running."
-                )
-                raise HTTPException(status_code=400, detail=detail) from exc
-            raise HTTPException(
-                status_code=exc.response.status_code,
-                detail=f"Model call failed after fallback: {exc}. Response: {exc.response.text}",
-            ) from exc
+            raise self._completion_error(exc) from exc
+        except HTTPException:
+            raise
         except Exception as exc:  # pragma: no cover - runtime guardrail
             raise HTTPException(status_code=500, detail=f"Model call failed after fallback: {exc}")
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        client: httpx.AsyncClient,
+        session_id: Optional[str] = None,
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> AsyncIterator[str]:
+        """Yield completion text as llama.cpp streams it, with the same chat-first / completions fallback."""
+        started = time.perf_counter()
+        first = True
+        async for token in self._generate_stream(prompt, client, session_id, history):
+            if first:
+                metrics.observe("llm_ttfb", time.perf_counter() - started)
+                first = False
+            yield token
+        metrics.observe("llm_generation", time.perf_counter() - started)
+
+    async def _generate_stream(
+        self, prompt: str, client: httpx.AsyncClient, session_id: Optional[str], history: Sequence[Tuple[str, str]]
+    ) -> AsyncIterator[str]:
+        if self._chat_first():
+            try:
+                async with client.stream(
+                    "POST",
+                    f"{self.api_base}/chat/completions",
+                    json=self._chat_body(prompt, stream=True, session_id=session_id, history=history),
+                ) as resp:
+                    if resp.is_error:
+                        await resp.aread()
+                    resp.raise_for_status()
+                    emitted = False
+                    async for token in _iter_sse(resp, _extract_chat_delta):
+                        emitted = True
+                        yield token
+                    if emitted:
+                        self._remember("chat")
+                        return
+                    logger.warning("Chat completion stream produced no content; retrying with /completions")
+                    metrics.LLM_FALLBACKS.inc(reason="empty")
+                    self._remember("completions")
+            except httpx.HTTPStatusError as exc:
+                error = self._chat_error(exc)
+                if error is not None:
+                    raise error from exc
+                self._remember("completions")
+            except Exception as exc:  # pragma: no cover - runtime guardrail
+                raise HTTPException(status_code=500, detail=f"Model call failed: {exc}") from exc
+
+        # Fallback to legacy /completions (or the remembered choice on servers without chat support)
+        try:
+            async with client.stream(
+                "POST",
+                f"{self.api_base}/completions",
+                json=self._completion_body(prompt, stream=True, session_id=session_id, history=history),
+            ) as resp:
+                if resp.is_error:
+                    await resp.aread()
+                resp.raise_for_status()
+                emitted = False
+                async for token in _iter_sse(resp, _extract_completion_delta):
+                    emitted = True
+                    yield token
+                if not emitted:
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Model returned an empty stream from /completions",
+                    )
+        except httpx.HTTPStatusError as exc:
+            raise self._completion_error(exc) from exc
+        except HTTPException:
+            raise
+        except Exception as exc:  # pragma: no cover - runtime guardrail
+            raise HTTPException(status_code=500, detail=f"Model call failed after fallback: {exc}") from exc
+
+
+class LlamaTokenCounter:
+    """Count tokens with llama-server's /tokenize, caching per text and estimating when it is unavailable."""
+
+    def __init__(self, api_base: str, cache_size: int = 4096) -> None:
+        self.tokenize_url = f"{server_root(api_base)}/tokenize"
+        self._cache: LRUCache[int] = LRUCache(cache_size)
+        self._remote = True
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        # ~4 characters per token for English text with Llama-style BPE vocabularies.
+        return max(1, (len(text) + 3) // 4)
+
+    async def count(self, text: str, client: Optional[httpx.AsyncClient]) -> int:
+        cached = self._cache.get(text)
+        if cached is not None:
+            return cached
+        if not self._remote or client is None:
+            return self.estimate(text)
+        try:
+            resp = await client.post(self.tokenize_url, json={"content": text})
+            if resp.status_code == 404:
+                logger.warning("llama-server has no /tokenize endpoint; estimating token counts instead")
+                self._remote = False
+                return self.estimate(text)
+            resp.raise_for_status()
+            count = len(resp.json().get("tokens", []))
+        except (httpx.HTTPError, ValueError) as exc:
+            logger.debug("Tokenize call failed (%s); estimating token count", exc)
+            return self.estimate(text)
+        self._cache.put(text, count)
+        return count
@@ -1,20 +1,33 @@
 import asyncio
+import json
 import logging
 import pathlib
+import time
+import uuid
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
 import httpx
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from app.config import AppConfig
-from app.llm import LlamaCPPClient
-from app.rag import RAGConfig, RAGPipeline
+from app import metrics
+from app.balancer import Backend, BackendPool
+from app.cache import AnswerCache, CachedAnswer
+from app.config import AppConfig, BackendSettings
+from app.context import ContextPacker
+from app.llm import LlamaCPPClient, LlamaTokenCounter
+from app.rag import SYSTEM_PROMPT, RAGConfig, RAGPipeline
+from app.sessions import FOLLOW_UP_REUSES, SessionStore, Turn, is_follow_up, select_history
 
 logger = logging.getLogger(__name__)
 
+# Finished background ingest jobs kept for GET /ingest/jobs.
+INGEST_JOB_HISTORY = 20
+
 
 def load_config(config_path: pathlib.Path) -> AppConfig:
     if not config_path.exists():
@@ -25,36 +38,64 @@ def load_config(config_path: pathlib.Path) -> AppConfig:
 
 
 def build_pipeline(config: AppConfig) -> RAGPipeline:
-    rag_config = RAGConfig(
-        index_dir=pathlib.Path(config.data.index_dir),
-        embedding_model=config.embedding.model,
-        device=config.embedding.device,
-        chunk_size=config.retrieval.chunk_size,
-        chunk_overlap=config.retrieval.chunk_overlap,
-        top_k=config.retrieval.k,
-        cache_dir=pathlib.Path(config.embedding.cache_dir) if config.embedding.cache_dir else None,
-        local_files_only=config.embedding.local_files_only,
-    )
-    pipeline = RAGPipeline(rag_config)
-    pipeline.prime()
-    return pipeline
+    # Cheap: the embedding model and index are loaded by prime() during app startup.
+    return RAGPipeline(RAGConfig.from_app_config(config))
 
 
-def build_llm_client(config: AppConfig) -> LlamaCPPClient:
+def build_llm_client(config: AppConfig, api_base: Optional[str] = None) -> LlamaCPPClient:
     return LlamaCPPClient(
-        api_base=config.model.api_base,
+        api_base=api_base or config.model.api_base,
         model_name=config.model.name,
         max_tokens=config.model.max_tokens,
         temperature=config.model.temperature,
         timeout_seconds=config.model.timeout_seconds if hasattr(config.model, "timeout_seconds") else 120,
+        system_prompt=SYSTEM_PROMPT,
+        cache_prompt=config.model.cache_prompt,
+        slot_affinity=config.model.slot_affinity,
+        parallel_slots=config.model.parallel_slots,
+        endpoint=config.model.endpoint,
+    )
+
+
+def build_backend_pool(config: AppConfig) -> BackendPool:
+    # model.api_base always takes part; an entry for it in model.backends only sets its limit.
+    settings: Dict[str, BackendSettings] = {config.model.api_base.rstrip("/"): BackendSettings(config.model.api_base)}
+    for backend in config.model.backends:
+        settings[backend.api_base.rstrip("/")] = backend
+    backends = [
+        Backend(
+            client=build_llm_client(config, backend.api_base),
+            max_concurrency=backend.max_concurrency or max(config.model.parallel_slots, 1),
+            discover_slots=backend.max_concurrency is None,
+        )
+        for backend in settings.values()
+    ]
+    return BackendPool(
+        backends,
+        queue_size=config.model.admission_queue_size,
+        queue_timeout_seconds=config.model.admission_timeout_seconds,
+        session_affinity=config.model.slot_affinity,
+    )
+
+
+def build_http_client(config: AppConfig) -> httpx.AsyncClient:
+    http2 = config.model.http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("model.http2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+    limits = httpx.Limits(
+        max_connections=config.model.max_connections,
+        max_keepalive_connections=config.model.max_keepalive_connections,
+        keepalive_expiry=config.model.keepalive_expiry,
     )
+    return httpx.AsyncClient(timeout=config.model.timeout_seconds, limits=limits, http2=http2)
 
 
-async def verify_llama_server(client: httpx.AsyncClient, llm: LlamaCPPClient) -> None:
-    """
-    Detect the common router-mode / no-model issue up front.
-    If /v1/models exists and shows zero or missing models, raise a clear error.
-    """
+async def check_loaded_model(client: httpx.AsyncClient, llm: LlamaCPPClient) -> None:
+    """If /v1/models exists and shows zero or missing models, raise a clear error."""
     try:
         resp = await client.get(f"{llm.api_base}/models")
     except httpx.HTTPError:
@@ -89,19 +130,101 @@ async def verify_llama_server(client: httpx.AsyncClient, llm: LlamaCPPClient) ->
         )
 
 
-def get_app(config_path: pathlib.Path = pathlib.Path("config.yaml")) -> FastAPI:
-    config = load_config(config_path)
+def build_context_packer(config: AppConfig, counter: LlamaTokenCounter) -> Optional[ContextPacker]:
+    if not config.retrieval.pack_context:
+        return None
+    return ContextPacker(
+        counter=counter,
+        context_window=config.model.context_window,
+        max_tokens=config.model.max_tokens,
+        chunk_overlap=config.retrieval.chunk_overlap,
+        system_prompt=SYSTEM_PROMPT,
+        budget_tokens=config.retrieval.context_token_budget,
+    )
+
+
+def build_answer_cache(config: AppConfig) -> Optional[AnswerCache]:
+    if not config.answer_cache.enabled:
+        return None
+    return AnswerCache(
+        max_size=config.answer_cache.max_entries,
+        ttl_seconds=config.answer_cache.ttl_seconds,
+        similarity_threshold=config.answer_cache.similarity_threshold,
+    )
+
+
+def build_session_store(config: AppConfig) -> Optional[SessionStore]:
+    if not config.sessions.enabled:
+        return None
+    return SessionStore(
+        max_sessions=config.sessions.max_sessions,
+        ttl_seconds=config.sessions.ttl_seconds,
+        max_turns=config.sessions.max_turns,
+        spill_dir=pathlib.Path(config.sessions.spill_dir) if config.sessions.spill_dir else None,
+    )
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def get_app(config_path: pathlib.Path = pathlib.Path("config.yaml"), config: Optional[AppConfig] = None) -> FastAPI:
+    config = config or load_config(config_path)
     config.ensure_data_dirs()
     rag_pipeline = build_pipeline(config)
-    llama_client = build_llm_client(config)
+    backend_pool = build_backend_pool(config)
+    answer_cache = build_answer_cache(config)
+    token_counter = LlamaTokenCounter(config.model.api_base)
+    context_packer = build_context_packer(config, token_counter)
+    session_store = build_session_store(config)
+
+    startup: Dict[str, Any] = {"error": None, "task": None}
+
+    async def prime_pipeline() -> None:
+        try:
+            await asyncio.to_thread(rag_pipeline.prime)
+        except Exception as exc:  # pragma: no cover - runtime guardrail
+            logger.exception("Failed to load the RAG pipeline")
+            startup["error"] = str(exc)
+            if not config.server.lazy_startup:
+                raise
+
+    async def probe_endpoints(client: httpx.AsyncClient) -> None:
+        """
+        Find which completion endpoint each backend supports, so requests stop paying for a failing
+        /chat/completions call. Runs in the background: until a probe answers, requests try chat first and
+        fall back per request. Repeats every endpoint_reprobe_seconds, since a llama-server restarted with a
+        newer (or older) build may have gained or lost chat support.
+        """
+        while True:
+            await asyncio.gather(*(backend.client.probe(client) for backend in backend_pool.backends))
+            if config.model.endpoint_reprobe_seconds <= 0:
+                return
+            await asyncio.sleep(config.model.endpoint_reprobe_seconds)
 
     @asynccontextmanager
     async def lifespan(_: FastAPI):
-        async with httpx.AsyncClient(timeout=config.model.timeout_seconds) as client:
+        if config.server.lazy_startup:
+            startup["task"] = asyncio.create_task(prime_pipeline())
+        else:
+            await prime_pipeline()
+        async with build_http_client(config) as client:
             app.state.http_client = client
-            await verify_llama_server(client, llama_client)
+            await asyncio.gather(*(check_loaded_model(client, backend.client) for backend in backend_pool.backends))
+            tasks = []
+            if config.model.endpoint == "auto":
+                tasks.append(asyncio.create_task(probe_endpoints(client)))
+            if config.model.health_check_seconds > 0:
+                tasks.append(
+                    asyncio.create_task(backend_pool.run_health_checks(client, config.model.health_check_seconds))
+                )
             yield
+            for task in tasks:
+                task.cancel()
         app.state.http_client = None
+        rag_pipeline.close()
+        if session_store is not None and session_store.spill_dir is not None:
+            session_store.spill_all()
 
     app = FastAPI(title="Bonsai Chatbot API", version="2.0", lifespan=lifespan)
 
@@ -113,47 +236,360 @@ def get_app(config_path: pathlib.Path = pathlib.Path("config.yaml")) -> FastAPI:
         allow_headers=["*"],
     )
 
+    @app.middleware("http")
+    async def record_latency(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # Route templates rather than raw paths keep label cardinality bounded; streams are timed to first byte.
+        route = request.scope.get("route")
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            path=getattr(route, "path", "unmatched"),
+            status=str(response.status_code),
+        )
+        return response
+
     class AskRequest(BaseModel):
         question: str
+        session_id: Optional[str] = None
+        timings: bool = False
 
     class AskResponse(BaseModel):
         answer: str
-        sources: List[Dict[str, str]]
+        sources: List[Dict[str, Any]]
+        timings: Optional[Dict[str, float]] = None
+
+    class BatchAskRequest(BaseModel):
+        questions: List[str]
+        timings: bool = False
 
     class IngestResponse(BaseModel):
         chunks: int
 
+    class IngestJob(BaseModel):
+        job_id: str
+        status: str  # queued, running, succeeded or failed
+        full: bool
+        started_at: float
+        finished_at: Optional[float] = None
+        files: int = 0
+        chunks: int = 0
+        error: Optional[str] = None
+
+    ingest_jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+
+    def require_ready() -> None:
+        if rag_pipeline.ready:
+            return
+        if startup["error"]:
+            raise HTTPException(status_code=503, detail=f"RAG pipeline failed to load: {startup['error']}")
+        raise HTTPException(
+            status_code=503,
+            detail="Loading the embedding model and index; retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+
     @app.get("/health")
     async def health() -> Dict[str, str]:
         return {"status": "ok"}
 
-    @app.post("/ask", response_model=AskResponse)
+    @app.get("/ready")
+    async def ready():
+        status = "ready" if rag_pipeline.ready else ("failed" if startup["error"] else "loading")
+        body = {"status": status, "timings": dict(rag_pipeline.timings), "error": startup["error"]}
+        return JSONResponse(body, status_code=200 if rag_pipeline.ready else 503)
+
+    async def lookup_answer(question: str) -> Tuple[Optional[CachedAnswer], Optional[List[float]]]:
+        """Return (cached answer, question embedding); the embedding is only computed for similarity matching."""
+        if answer_cache is None:
+            return None, None
+        cached = answer_cache.lookup(question, rag_pipeline.generation)
+        if cached is None and answer_cache.similarity_threshold:
+            embedding = await rag_pipeline.aembed_query(question)
+            cached = answer_cache.lookup_similar(embedding, rag_pipeline.generation)
+        else:
+            embedding = None
+        if cached is not None:
+            metrics.CACHE_HITS.inc()
+        return cached, embedding
+
+    def store_answer(
+        question: str, generation: int, answer: str, hits: Sequence[dict], embedding: Optional[List[float]]
+    ) -> None:
+        if answer_cache is not None and answer:
+            answer_cache.store(question, generation, answer, hits, embedding)
+
+    async def prepare_prompt(
+        question: str, hits: Sequence[dict], client: Optional[httpx.AsyncClient], reserved_tokens: int = 0
+    ) -> str:
+        with metrics.timed("prompt_build"):
+            if context_packer is not None:
+                hits = await context_packer.pack(question, hits, client, reserved_tokens)
+            return rag_pipeline.build_prompt(question, hits, sort_context=config.model.cache_prompt)
+
+    def session_turns(session_id: Optional[str]) -> List[Turn]:
+        if session_store is None or not session_id:
+            return []
+        session = session_store.get(session_id)
+        return session.turns if session is not None else []
+
+    async def retrieve_for_turn(
+        question: str, session_id: Optional[str], turns: Sequence[Turn], embedding: Optional[List[float]]
+    ) -> Tuple[Sequence[dict], Optional[List[float]]]:
+        """Retrieve context, or reuse the previous turn's hits for a close follow-up in the same session."""
+        if session_store is None or not session_id:
+            return await rag_pipeline.aretrieve(question, embedding), embedding
+        # Sessions keep each turn's embedding, so the next question can be compared with it.
+        if embedding is None:
+            embedding = await rag_pipeline.aembed_query(question)
+        if turns and is_follow_up(turns[-1], embedding, rag_pipeline.generation, config.sessions.follow_up_threshold):
+            FOLLOW_UP_REUSES.inc()
+            return turns[-1].hits, embedding
+        return await rag_pipeline.aretrieve(question, embedding), embedding
+
+    async def conversation_history(
+        turns: Sequence[Turn], client: Optional[httpx.AsyncClient]
+    ) -> Tuple[List[Tuple[str, str]], int]:
+        if not turns:
+            return [], 0
+        return await select_history(turns, token_counter, config.sessions.history_token_budget, client)
+
+    def remember_turn(
+        session_id: Optional[str],
+        question: str,
+        answer: str,
+        hits: Sequence[dict],
+        embedding: Optional[List[float]],
+        generation: int,
+    ) -> None:
+        if session_store is not None and session_id and answer:
+            session_store.append(session_id, Turn(question, answer, list(hits), embedding, generation))
+
+    def finish_timings(timings: Dict[str, float], started: float, wanted: bool) -> Optional[Dict[str, float]]:
+        if not wanted:
+            return None
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000.0, 3)
+        return timings
+
+    @app.get("/backends")
+    async def backends() -> Dict[str, Any]:
+        return backend_pool.status()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus_metrics() -> PlainTextResponse:
+        return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/cache/stats")
+    async def cache_stats() -> Dict[str, Any]:
+        return {
+            "answers": answer_cache.stats() if answer_cache is not None else None,
+            "sessions": session_store.stats() if session_store is not None else None,
+            **rag_pipeline.cache_stats(),
+        }
+
+    @app.delete("/sessions/{session_id}")
+    async def delete_session(session_id: str) -> Dict[str, Any]:
+        if session_store is None:
+            raise HTTPException(status_code=404, detail="Sessions are disabled.")
+        if not session_store.delete(session_id):
+            raise HTTPException(status_code=404, detail=f"Unknown session '{session_id}'.")
+        return {"deleted": session_id}
+
+    @app.post("/ask", response_model=AskResponse, response_model_exclude_none=True)
     async def ask(payload: AskRequest):
-        hits = rag_pipeline.retrieve(payload.question)
-        prompt = rag_pipeline.build_prompt(payload.question, hits)
+        require_ready()
+        started = time.perf_counter()
+        with metrics.track_request() as timings:
+            return await answer_question(payload, timings, started)
+
+    async def answer_question(payload: AskRequest, timings: Dict[str, float], started: float) -> AskResponse:
+        turns = session_turns(payload.session_id)
+        # A follow-up's answer depends on the conversation, so only first questions use the answer cache.
+        cached, embedding = await lookup_answer(payload.question) if not turns else (None, None)
+        if cached is not None:
+            timings["cached"] = 1
+            remember_turn(
+                payload.session_id, payload.question, cached.answer, cached.sources, embedding, rag_pipeline.generation
+            )
+            return AskResponse(
+                answer=cached.answer,
+                sources=cached.sources,
+                timings=finish_timings(timings, started, payload.timings),
+            )
+
+        generation = rag_pipeline.generation
+        hits, embedding = await retrieve_for_turn(payload.question, payload.session_id, turns, embedding)
 
         client: httpx.AsyncClient = getattr(app.state, "http_client", None)
         if client is None:
             raise HTTPException(status_code=500, detail="HTTP client not initialized.")
+        history, history_tokens = await conversation_history(turns, client)
+        prompt = await prepare_prompt(payload.question, hits, client, history_tokens)
+
+        async with backend_pool.lease(payload.session_id) as backend:
+            try:
+                content = await backend.client.generate(
+                    prompt, client, session_id=payload.session_id, history=history
+                )
+            except httpx.ConnectError as exc:  # pragma: no cover - runtime guardrail
+                raise HTTPException(
+                    status_code=502,
+                    detail=(
+                        f"Failed to reach llama.cpp at {backend.client.api_base}. "
+                        "Ensure llama-server.exe is running and config.model.api_base matches."
+                    ),
+                ) from exc
+
+        answer = content.strip()
+        if not turns:
+            store_answer(payload.question, generation, answer, hits, embedding)
+        remember_turn(payload.session_id, payload.question, answer, hits, embedding, generation)
+        return AskResponse(answer=answer, sources=list(hits), timings=finish_timings(timings, started, payload.timings))
+
+    @app.post("/ask/stream")
+    async def ask_stream(payload: AskRequest):
+        require_ready()
+        started = time.perf_counter()
+        turns = session_turns(payload.session_id)
+        with metrics.track_request() as timings:
+            cached, embedding = await lookup_answer(payload.question) if not turns else (None, None)
+        if cached is not None:
+            remember_turn(
+                payload.session_id, payload.question, cached.answer, cached.sources, embedding, rag_pipeline.generation
+            )
+
+            async def cached_events() -> AsyncIterator[str]:
+                yield sse_event("sources", cached.sources)
+                yield sse_event("token", cached.answer)
+                timings["cached"] = 1
+                done = {"cached": True}
+                if payload.timings:
+                    done["timings"] = finish_timings(timings, started, True)
+                yield sse_event("done", done)
+
+            return StreamingResponse(cached_events(), media_type="text/event-stream")
 
+        client: httpx.AsyncClient = getattr(app.state, "http_client", None)
+        if client is None:
+            raise HTTPException(status_code=500, detail="HTTP client not initialized.")
+        # Refuse before the 200 and event stream start; the backend itself is leased inside the body.
+        backend_pool.reject_if_saturated()
+        with metrics.track_request(timings):
+            generation = rag_pipeline.generation
+            hits, embedding = await retrieve_for_turn(payload.question, payload.session_id, turns, embedding)
+            history, history_tokens = await conversation_history(turns, client)
+            prompt = await prepare_prompt(payload.question, hits, client, history_tokens)
+
+        async def events() -> AsyncIterator[str]:
+            yield sse_event("sources", list(hits))
+            tokens: List[str] = []
+            # The body runs after this handler returns, so re-attach the request's timings here.
+            metrics.bind_request(timings)
+            try:
+                async with backend_pool.lease(payload.session_id) as backend:
+                    async for token in backend.client.generate_stream(
+                        prompt, client, session_id=payload.session_id, history=history
+                    ):
+                        tokens.append(token)
+                        yield sse_event("token", token)
+            except HTTPException as exc:
+                yield sse_event("error", {"status": exc.status_code, "detail": exc.detail})
+                return
+            answer = "".join(tokens).strip()
+            if not turns:
+                store_answer(payload.question, generation, answer, hits, embedding)
+            remember_turn(payload.session_id, payload.question, answer, hits, embedding, generation)
+            yield sse_event("done", {"timings": finish_timings(timings, started, True)} if payload.timings else {})
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.post("/ask/batch")
+    async def ask_batch(payload: BatchAskRequest):
+        """Answer many questions; results stream back as JSON lines in completion order."""
+        require_ready()
+        client: httpx.AsyncClient = getattr(app.state, "http_client", None)
+        if client is None:
+            raise HTTPException(status_code=500, detail="HTTP client not initialized.")
+
+        questions = payload.questions
+        all_hits = await rag_pipeline.aretrieve_many(questions) if questions else []
+
+        async def answer(index: int, question: str, hits: Sequence[dict]) -> Dict[str, Any]:
+            started = time.perf_counter()
+            with metrics.track_request() as timings:
+                try:
+                    # Batch work waits for a free backend slot without taking up the interactive admission queue.
+                    async with backend_pool.lease(background=True) as backend:
+                        prompt = await prepare_prompt(question, hits, client)
+                        content = await backend.client.generate(prompt, client)
+                except HTTPException as exc:
+                    return {"index": index, "question": question, "error": exc.detail, "status": exc.status_code}
+            result = {"index": index, "question": question, "answer": content.strip(), "sources": list(hits)}
+            if payload.timings:
+                # Retrieval is shared by the whole batch, so only prompt build and generation are per question.
+                result["timings"] = finish_timings(timings, started, True)
+            return result
+
+        async def lines() -> AsyncIterator[str]:
+            tasks = [asyncio.create_task(answer(i, q, hits)) for i, (q, hits) in enumerate(zip(questions, all_hits))]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield json.dumps(await task) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    def job_status(job: IngestJob) -> IngestJob:
+        progress = rag_pipeline.progress
+        if job.status == "running" and progress is not None:
+            return job.model_copy(update={"files": progress.files, "chunks": progress.chunks})
+        return job
+
+    async def run_ingest_job(job: IngestJob, incremental: bool) -> None:
+        loop = asyncio.get_event_loop()
+        job.status = "running"
         try:
-            content = await llama_client.generate(prompt, client)
-        except httpx.ConnectError as exc:  # pragma: no cover - runtime guardrail
-            raise HTTPException(
-                status_code=502,
-                detail=(
-                    f"Failed to reach llama.cpp at {llama_client.api_base}. "
-                    "Ensure llama-server.exe is running and config.model.api_base matches."
-                ),
-            ) from exc
-
-        return AskResponse(answer=content.strip(), sources=list(hits))
-
-    @app.post("/ingest", response_model=IngestResponse)
-    async def ingest():
+            await loop.run_in_executor(None, rag_pipeline.rebuild, pathlib.Path(config.data.raw_dir), incremental)
+        except Exception as exc:
+            logger.exception("Background ingest %s failed", job.job_id)
+            job.status, job.error = "failed", str(exc)
+        else:
+            job.status = "succeeded"
+        progress = rag_pipeline.progress
+        if progress is not None:
+            job.files, job.chunks = progress.files, progress.chunks
+        job.finished_at = time.time()
+        while len(ingest_jobs) > INGEST_JOB_HISTORY:
+            ingest_jobs.popitem(last=False)
+
+    @app.post("/ingest", response_model=IngestResponse, responses={202: {"model": IngestJob}})
+    async def ingest(full: bool = False, background: bool = False):
+        """
+        Re-index data/raw. Full rebuilds build a new index version and swap it in, so /ask keeps answering
+        from the old one meanwhile. With ``background`` the call returns 202 at once; poll the job's Location.
+        """
+        require_ready()
+        incremental = config.data.incremental and not full
+        if background:
+            if any(job.status in ("queued", "running") for job in ingest_jobs.values()):
+                raise HTTPException(status_code=409, detail="An ingest job is already running.")
+            job = IngestJob(job_id=uuid.uuid4().hex, status="queued", full=not incremental, started_at=time.time())
+            ingest_jobs[job.job_id] = job
+            # Keep a reference: the event loop only holds tasks weakly.
+            app.state.ingest_task = asyncio.create_task(run_ingest_job(job, incremental))
+            return JSONResponse(job.model_dump(), status_code=202, headers={"Location": f"/ingest/jobs/{job.job_id}"})
+
         loop = asyncio.get_event_loop()
         try:
-            count = await loop.run_in_executor(None, rag_pipeline.rebuild, pathlib.Path(config.data.raw_dir))
+            count = await loop.run_in_executor(
+                None, rag_pipeline.rebuild, pathlib.Path(config.data.raw_dir), incremental
+            )
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc))
         except Exception as exc:  # pragma: no cover - runtime guardrail
@@ -161,7 +597,24 @@ def get_app(config_path: pathlib.Path = pathlib.Path("config.yaml")) -> FastAPI:
 
         return IngestResponse(chunks=count)
 
+    @app.get("/ingest/jobs", response_model=List[IngestJob])
+    async def list_ingest_jobs():
+        return [job_status(job) for job in reversed(ingest_jobs.values())]
+
+    @app.get("/ingest/jobs/{job_id}", response_model=IngestJob)
+    async def get_ingest_job(job_id: str):
+        job = ingest_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown ingest job '{job_id}'")
+        return job_status(job)
+
     return app
 
 
-app = get_app()
+def __getattr__(name: str) -> Any:
+    # Built on first access, so `uvicorn app.main:app` keeps working while importing get_app (as app.bench
+    # does) does not load ./config.yaml, create its data dirs or start a pipeline.
+    if name == "app":
+        globals()["app"] = get_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,201 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Seconds; spans a cached embedding lookup up to a long CPU generation.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# Set by track_request; stages observed while it is set are also reported in that response's timings.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def _labels(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: (per-bucket counts with a trailing +Inf slot, sum, count).
+        self._series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            counts, totals = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), list(totals)) for key, (counts, totals) in self._series.items()}
+        lines = []
+        for key, (counts, (total, count)) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {int(count)}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format at /metrics."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._add(Gauge(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "bonsai_stage_seconds",
+    "Time spent per pipeline stage (embed, vector_query, lexical, rerank, prompt_build, llm_ttfb, llm_generation).",
+)
+REQUEST_SECONDS = REGISTRY.histogram("bonsai_request_seconds", "End-to-end HTTP request latency by path and status.")
+PROMPT_TOKENS = REGISTRY.histogram("bonsai_llm_prompt_tokens", "Prompt tokens per llama.cpp call.", TOKEN_BUCKETS)
+COMPLETION_TOKENS = REGISTRY.histogram(
+    "bonsai_llm_completion_tokens", "Completion tokens per llama.cpp call.", TOKEN_BUCKETS
+)
+LLM_SERVER_SECONDS = REGISTRY.histogram(
+    "bonsai_llm_server_seconds", "llama.cpp's own prompt-eval and decode time, from its timings field."
+)
+LLM_FALLBACKS = REGISTRY.counter("bonsai_llm_fallbacks_total", "Chat calls retried against /completions.")
+CACHE_HITS = REGISTRY.counter("bonsai_answer_cache_hits_total", "Questions answered from the answer cache.")
+INGEST_FILES = REGISTRY.counter("bonsai_ingest_files_total", "Files chunked and embedded by ingest.")
+INGEST_CHUNKS = REGISTRY.counter("bonsai_ingest_chunks_total", "Chunks embedded and written by ingest.")
+INGEST_SECONDS = REGISTRY.histogram("bonsai_ingest_seconds", "Wall time per ingest run.")
+INGEST_CHUNKS_PER_SECOND = REGISTRY.gauge("bonsai_ingest_chunks_per_second", "Throughput of the last ingest run.")
+
+
+@contextmanager
+def track_request(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """
+    Collect this request's stage timings (milliseconds) and token counts into the yielded dict.
+    Pass an existing dict to keep adding to it.
+    """
+    timings = {} if timings is None else timings
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def bind_request(timings: Dict[str, float]) -> None:
+    """
+    Attach ``timings`` to the current context without a matching reset. For streaming response
+    bodies, which run in their own task after the handler's track_request block has exited.
+    """
+    _request_timings.set(timings)
+
+
+def observe(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        key = f"{stage}_ms"
+        timings[key] = round(timings.get(key, 0.0) + seconds * 1000.0, 3)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def record_usage(prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+    timings = _request_timings.get()
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.observe(prompt_tokens)
+        if timings is not None:
+            timings["prompt_tokens"] = prompt_tokens
+    if completion_tokens is not None:
+        COMPLETION_TOKENS.observe(completion_tokens)
+        if timings is not None:
+            timings["completion_tokens"] = completion_tokens
+
+
+def record_ingest(files: int, chunks: int, seconds: float) -> None:
+    INGEST_FILES.inc(files)
+    INGEST_CHUNKS.inc(chunks)
+    INGEST_SECONDS.observe(seconds)
+    INGEST_CHUNKS_PER_SECOND.set(chunks / max(seconds, 1e-9))
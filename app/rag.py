@@ -1,22 +1,52 @@
+import asyncio
+import contextvars
+import itertools
+import json
 import logging
 import os
 import pathlib
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import lru_cache
 from threading import Lock
-from typing import List, Optional, Sequence
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
-# Silence Chroma telemetry warnings/errors in constrained environments.
-os.environ.setdefault("CHROMA_TELEMETRY_ENABLED", "false")
+from app import metrics, utils
+from app.cache import LRUCache
+from app.chunking import SPECIAL_TOKENS, Chunk, Chunker, model_max_tokens
+from app.config import AppConfig
+from app.context import chunk_position
+from app.embeddings import OnnxEmbedding, embedding_variant, tokenizer_file
+from app.lexical import LEXICAL_DIR, LexicalIndex, reciprocal_rank_fusion, tokenize
+from app.rerank import RERANKERS, CrossEncoderReranker, MMRReranker, Reranker
+from app.store import VectorStore, build_store, list_versions, version_dir
 
-import chromadb
-from chromadb.api.types import Documents, EmbeddingFunction, Embeddings, Metadatas
-from sentence_transformers import SentenceTransformer
-
-from app import utils
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = "manifest.json"
+RERANKS_SKIPPED = metrics.REGISTRY.counter(
+    "bonsai_reranks_skipped_total", "Questions answered in retrieval order because reranking ran out of budget."
+)
+# How often searches look for a version promoted by another process.
+VERSION_CHECK_SECONDS = 1.0
+
+# Kept byte-identical across requests so llama-server can reuse the system prompt's KV cache.
+SYSTEM_PROMPT = (
+    "You are a helpful bonsai assistant. Use only the provided context. "
+    "If the answer is not in the context, say you don't know."
+)
+
+# (chunk id, document text, metadata) as produced by the ingest generators.
+Record = Tuple[str, str, Dict[str, Any]]
+Embeddings = List[List[float]]
+
 
 @dataclass
 class RAGConfig:
@@ -26,15 +56,79 @@ class RAGConfig:
     chunk_size: int
     chunk_overlap: int
     top_k: int
+    chunker: str = "structured"
     cache_dir: Optional[pathlib.Path] = None
     local_files_only: bool = False
+    embedding_backend: str = "sentence-transformers"
+    onnx_path: Optional[str] = None
+    embedding_quantized: bool = False
+    embedding_threads: int = 0
     collection_name: str = "bonsai"
+    vector_store: str = "chroma"
+    vector_dtype: str = "float32"
+    embed_batch_size: int = 64
+    ingest_workers: int = 0
+    ingest_queue_size: int = 16
+    index_gc_grace_seconds: float = 30.0
+    query_workers: int = 16
+    query_batch_max_size: int = 16
+    query_batch_max_wait_ms: float = 5.0
+    embedding_cache_size: int = 1024
+    result_cache_size: int = 512
+    hybrid: bool = True
+    lexical_candidates: int = 20
+    rrf_k: int = 60
+    rerank: str = "none"
+    rerank_candidates: int = 20
+    rerank_budget_ms: Optional[float] = 150.0
+    mmr_diversity: float = 0.3
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+    @classmethod
+    def from_app_config(cls, config: AppConfig) -> "RAGConfig":
+        return cls(
+            index_dir=pathlib.Path(config.data.index_dir),
+            embedding_model=config.embedding.model,
+            device=config.embedding.device,
+            chunk_size=config.retrieval.chunk_size,
+            chunk_overlap=config.retrieval.chunk_overlap,
+            top_k=config.retrieval.k,
+            chunker=config.retrieval.chunker,
+            cache_dir=pathlib.Path(config.embedding.cache_dir) if config.embedding.cache_dir else None,
+            local_files_only=config.embedding.local_files_only,
+            embedding_backend=config.embedding.backend,
+            onnx_path=config.embedding.onnx_path,
+            embedding_quantized=config.embedding.quantized,
+            embedding_threads=config.embedding.threads,
+            vector_store=config.data.vector_store,
+            vector_dtype=config.data.vector_dtype,
+            embed_batch_size=config.embedding.batch_size,
+            ingest_workers=config.data.ingest_workers,
+            ingest_queue_size=config.data.ingest_queue_size,
+            index_gc_grace_seconds=config.data.index_gc_grace_seconds,
+            query_workers=config.retrieval.query_workers,
+            query_batch_max_size=config.retrieval.query_batch_max_size,
+            query_batch_max_wait_ms=config.retrieval.query_batch_max_wait_ms,
+            embedding_cache_size=config.retrieval.embedding_cache_size,
+            result_cache_size=config.retrieval.result_cache_size,
+            hybrid=config.retrieval.hybrid,
+            lexical_candidates=config.retrieval.lexical_candidates,
+            rrf_k=config.retrieval.rrf_k,
+            rerank=config.retrieval.rerank,
+            rerank_candidates=config.retrieval.rerank_candidates,
+            rerank_budget_ms=config.retrieval.rerank_budget_ms,
+            mmr_diversity=config.retrieval.mmr_diversity,
+            rerank_model=config.retrieval.rerank_model,
+        )
 
 
 @lru_cache(maxsize=2)
 def _load_embedding_model(
     model_name: str, device: str, cache_dir: Optional[str], local_files_only: bool
-) -> SentenceTransformer:
+) -> "SentenceTransformer":
+    # Imported here: torch + sentence-transformers take seconds to import, and the API binds first.
+    from sentence_transformers import SentenceTransformer
+
     try:
         logger.info("Loading embedding model '%s' on device '%s' (cache_dir=%s)", model_name, device, cache_dir)
         return SentenceTransformer(
@@ -53,104 +147,752 @@ def _load_embedding_model(
         raise RuntimeError(hint) from exc
 
 
-class SentenceTransformerEmbedding(EmbeddingFunction):
+class SentenceTransformerEmbedding:
     def __init__(
         self,
         model_name: str,
         device: str,
         cache_dir: Optional[pathlib.Path],
         local_files_only: bool,
+        batch_size: int = 32,
     ) -> None:
         cache_dir_str = str(cache_dir) if cache_dir else None
+        self.batch_size = batch_size
         self.model = _load_embedding_model(model_name, device, cache_dir_str, local_files_only)
 
-    def __call__(self, input: Documents) -> Embeddings:  # type: ignore[override]
-        return self.model.encode(list(input), normalize_embeddings=True).tolist()
+    def __call__(self, input: Sequence[str]) -> Embeddings:
+        return self.model.encode(list(input), batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+
+def build_embedding_fn(config: RAGConfig) -> Callable[[Sequence[str]], Embeddings]:
+    if config.embedding_backend == "onnx":
+        return OnnxEmbedding(
+            model_name=config.embedding_model,
+            onnx_path=config.onnx_path,
+            cache_dir=config.cache_dir,
+            local_files_only=config.local_files_only,
+            quantized=config.embedding_quantized,
+            threads=config.embedding_threads,
+            batch_size=config.embed_batch_size,
+        )
+    if config.embedding_backend != "sentence-transformers":
+        raise ValueError(
+            f"Unknown embedding backend '{config.embedding_backend}' (expected 'sentence-transformers' or 'onnx')"
+        )
+    return SentenceTransformerEmbedding(
+        model_name=config.embedding_model,
+        device=config.device,
+        cache_dir=config.cache_dir,
+        local_files_only=config.local_files_only,
+        batch_size=config.embed_batch_size,
+    )
+
+
+class QueryEmbeddingBatcher:
+    """Coalesce concurrent query encodes into a single ``model.encode`` call."""
+
+    def __init__(self, embed: Callable[[List[str]], Embeddings], max_batch_size: int, max_wait_ms: float) -> None:
+        self._embed = embed
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._closed = False
+        # Makes "not closed, then enqueue" atomic with close(), so nothing is queued behind the stop sentinel.
+        self._close_lock = Lock()
+        self._thread = threading.Thread(target=self._run, name="query-embed-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("Query embedding batcher is closed")
+            self._queue.put((text, future))
+        return future.result()
+
+    def close(self) -> None:
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self) -> None:
+        """Fail whatever is still queued once the worker stops, so no caller waits forever."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and not item[1].done():
+                item[1].set_exception(RuntimeError("Query embedding batcher is closed"))
+
+    def _serve(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                vectors = self._embed([text for text, _ in batch])
+            except Exception as exc:  # pragma: no cover - runtime guardrail
+                for _, future in batch:
+                    future.set_exception(exc)
+            else:
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            if stop:
+                return
 
 
-def build_client(index_dir: pathlib.Path) -> chromadb.Client:
-    index_dir.mkdir(parents=True, exist_ok=True)
-    return chromadb.PersistentClient(path=str(index_dir))
+class IngestProgress:
+    def __init__(self, interval_seconds: float = 5.0) -> None:
+        self.files = 0
+        self.chunks = 0
+        self._interval = interval_seconds
+        self._started = time.perf_counter()
+        self._last_report = self._started
+
+    def report(self, final: bool = False) -> None:
+        now = time.perf_counter()
+        if not final and now - self._last_report < self._interval:
+            return
+        self._last_report = now
+        elapsed = max(now - self._started, 1e-9)
+        if final:
+            metrics.record_ingest(self.files, self.chunks, elapsed)
+        logger.info(
+            "%s %d files, %d chunks in %.1fs (%.1f files/s, %.1f chunks/s)",
+            "Ingest finished:" if final else "Ingest progress:",
+            self.files,
+            self.chunks,
+            elapsed,
+            self.files / elapsed,
+            self.chunks / elapsed,
+        )
+
+
+@dataclass
+class IndexVersion:
+    """
+    One complete index: vectors, lexical index and the reranker bound to them. Full rebuilds
+    build a new version beside the live one and swap; ``readers`` counts in-flight searches so
+    a retired version is only deleted once they have finished.
+    """
+
+    # v<ns> timestamp; None for an index written before versioning.
+    name: Optional[str]
+    store: VectorStore
+    lexical: Optional[LexicalIndex] = None
+    reranker: Optional[Reranker] = None
+    # Bumped by every incremental ingest that changes this version in place; recorded in the manifest.
+    revision: int = 0
+    # RAGPipeline.generation when this version last changed; cached results are keyed on it.
+    generation: int = 0
+    readers: int = 0
+    retired: bool = False
 
 
-def ensure_collection(client: chromadb.Client, name: str, embedding_fn: EmbeddingFunction):
-    if name in {col.name for col in client.list_collections()}:
-        return client.get_collection(name=name, embedding_function=embedding_fn)
-    return client.create_collection(name=name, embedding_function=embedding_fn)
+def _version_age_key(name: Optional[str]) -> int:
+    return int(name[1:]) if name and name[1:].isdigit() else -1
 
 
 class RAGPipeline:
     def __init__(self, config: RAGConfig) -> None:
         self.config = config
-        self._embedding_fn = SentenceTransformerEmbedding(
-            model_name=config.embedding_model,
-            device=config.device,
-            cache_dir=config.cache_dir,
-            local_files_only=config.local_files_only,
-        )
-        self._client = build_client(config.index_dir)
-        self._collection = ensure_collection(self._client, config.collection_name, self._embedding_fn)
+        # Loaded by load(); construction stays cheap so the API can bind before the model is in memory.
+        self._embedding_fn: Optional[Callable[[Sequence[str]], Embeddings]] = None
+        self._index: Optional[IndexVersion] = None
+        self.ready = False
+        self.timings: Dict[str, float] = {}
+        self._load_lock = Lock()
         self._lock = Lock()
+        self._ingest_lock = Lock()
+        # Held while switching versions, so a search following the manifest cannot race a local promotion.
+        self._swap_lock = Lock()
+        self._manifest_mtime: Optional[int] = None
+        self._manifest_checked = 0.0
+        # Counts of the running ingest, for status polling.
+        self.progress: Optional[IngestProgress] = None
+        # Bumped whenever rebuild changes the index, so callers can drop anything derived from it.
+        self.generation = 0
+        self._embedding_cache: LRUCache[List[float]] = LRUCache(config.embedding_cache_size)
+        # Keyed on (embedding, top_k, generation) so hits from an older index are never served.
+        self._result_cache: LRUCache[List[dict]] = LRUCache(config.result_cache_size)
+        self._cross_encoder: Optional[Reranker] = None
+        # Query embedding + HNSW search run here so they never block the event loop.
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=max(config.query_workers, 1), thread_name_prefix="rag-query"
+        )
+        self._query_batcher: Optional[QueryEmbeddingBatcher] = None
+        self._chunker: Optional[Chunker] = None
+
+    def load(self) -> None:
+        """Load the embedding model and open the index, recording how long each part took."""
+        with self._load_lock:
+            if self._index is not None:
+                return
+            config = self.config
+
+            started = time.perf_counter()
+            self._embedding_fn = build_embedding_fn(config)
+            if config.query_batch_max_size > 1 and config.query_batch_max_wait_ms > 0:
+                self._query_batcher = QueryEmbeddingBatcher(
+                    self._embedding_fn, config.query_batch_max_size, config.query_batch_max_wait_ms
+                )
+            self.timings["embedding_model"] = time.perf_counter() - started
+
+            if config.rerank == "cross-encoder":
+                started = time.perf_counter()
+                self._cross_encoder = CrossEncoderReranker(
+                    config.rerank_model,
+                    config.device,
+                    str(config.cache_dir) if config.cache_dir else None,
+                    config.local_files_only,
+                )
+                self.timings["reranker"] = time.perf_counter() - started
+            elif config.rerank not in RERANKERS:
+                raise ValueError(f"Unknown reranker '{config.rerank}' (expected 'none', 'mmr' or 'cross-encoder')")
+
+            started = time.perf_counter()
+            self._manifest_mtime = self._manifest_stat()
+            manifest = self._load_manifest()
+            index = self._open_version(*self._manifest_version(manifest))
+            self.timings["index"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if config.hybrid and index.lexical is None and index.store.count():
+                logger.info("No lexical index found; building one from the existing vector store")
+                self._refresh_lexical_index(index)
+            self._index = index
+            self.timings["lexical_index"] = time.perf_counter() - started
+            self._sweep_versions()
+
+    def _open_version(self, name: Optional[str], revision: int = 0) -> IndexVersion:
+        config = self.config
+        store = build_store(config.index_dir, config.vector_store, config.collection_name, config.vector_dtype, name)
+        lexical = LexicalIndex.open(self._lexical_root(name)) if config.hybrid else None
+        if config.rerank == "mmr":
+            reranker: Optional[Reranker] = MMRReranker(store.get_embeddings, config.mmr_diversity)
+        else:
+            reranker = self._cross_encoder
+        return IndexVersion(name, store, lexical, reranker, revision)
+
+    def _lexical_root(self, name: Optional[str]) -> pathlib.Path:
+        return version_dir(self.config.index_dir, name) / LEXICAL_DIR
 
     def prime(self) -> None:
-        _ = self._embedding_fn
-        logger.info("RAG pipeline ready. Index at %s", self.config.index_dir)
+        """Load everything, then run a warm-up encode and query so the first real request is not slow."""
+        self.load()
+        self._check_index_compatible()
+        started = time.perf_counter()
+        embedding = self._embedding_fn(["warm-up query"])[0]
+        index = self._index
+        index.store.query([embedding], 1)
+        if index.lexical is not None:
+            index.lexical.search("warm-up query", 1)
+        self.timings["warmup"] = time.perf_counter() - started
+        self.ready = True
+        logger.info(
+            "RAG pipeline ready. Index at %s (%s)",
+            self.config.index_dir,
+            ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()),
+        )
+
+    def _check_index_compatible(self) -> None:
+        """Refuse to serve an index whose vectors came from a different embedding model or variant."""
+        manifest = self._load_manifest()
+        if manifest is None or not self._index.store.count():
+            return
+        built = manifest.get("params", {})
+        expected = self._manifest_params()
+        for key, default in (("embedding_model", None), ("embedding_variant", "fp32")):
+            if built.get(key, default) != expected[key]:
+                raise RuntimeError(
+                    f"Index at {self.config.index_dir} was built with {key}={built.get(key, default)!r} but the "
+                    f"configured embedding backend produces {key}={expected[key]!r}. Query vectors would not be "
+                    "comparable; re-run ingest with --full or change the embedding settings back."
+                )
+
+    def close(self) -> None:
+        self._query_executor.shutdown(wait=False, cancel_futures=True)
+        if self._query_batcher is not None:
+            self._query_batcher.close()
+
+    def rebuild(self, source_dir: pathlib.Path, incremental: bool = False) -> int:
+        self.load()
+        with self._ingest_lock:
+            manifest = self._load_manifest()
+            if incremental and (manifest is None or manifest.get("params") != self._manifest_params()):
+                logger.info("No usable manifest in %s; falling back to a full rebuild", self.config.index_dir)
+                incremental = False
+            if not incremental:
+                return self._full_rebuild(source_dir)
+            return self._update(self._index, source_dir, manifest["files"])
+
+    def _refresh_lexical_index(self, index: IndexVersion) -> None:
+        lexical = LexicalIndex.build(self._lexical_root(index.name), index.store.iter_documents())
+        with self._lock:
+            index.lexical = lexical
+
+    def _full_rebuild(self, source_dir: pathlib.Path) -> int:
+        """Build a new version beside the live one, check it, then promote it; the live index is never touched."""
+        index = self._open_version(f"v{time.time_ns()}")
+        logger.info("Building index version %s", index.name)
+        files: Dict[str, Dict[str, Any]] = {}
+        progress = self.progress = IngestProgress()
+
+        def records() -> Iterator[Record]:
+            jobs = ((path, None) for path in utils.iter_text_files(source_dir))
+            for path, digest, chunks in self._chunk_files(jobs):
+                rel = str(path.relative_to(source_dir))
+                chunks = chunks or []
+                files[rel] = {"sha256": digest, "chunks": len(chunks)}
+                progress.files += 1
+                for idx, chunk in enumerate(chunks):
+                    yield f"{rel}::{idx}", chunk.text, {"source": rel, **chunk.metadata()}
+
+        try:
+            written = self._write_batches(index.store, index.store.add, records(), progress)
+            index.store.flush()
+            if not written:
+                if self._index.store.count():
+                    raise ValueError(f"No documents found under {source_dir}; keeping the current index")
+                logger.warning("No documents found under %s; skipping ingestion", source_dir)
+            if self.config.hybrid:
+                index.lexical = LexicalIndex.build(self._lexical_root(index.name), index.store.iter_documents())
+            self._validate(index, written)
+        except BaseException:
+            logger.error("Index version %s was not promoted; removing it", index.name)
+            self._drop(index)
+            raise
+        self._promote(index, files)
+        return written
+
+    def _validate(self, index: IndexVersion, written: int) -> None:
+        """Check a freshly built version before it goes live: every chunk landed and stored vectors find themselves."""
+        count = index.store.count()
+        if count != written:
+            raise RuntimeError(f"Index version {index.name} holds {count} chunks, but {written} were written")
+        if not written:
+            return
+        chunk_id, _, text = next(index.store.iter_documents())
+        vector = index.store.get_embeddings([chunk_id]).get(chunk_id)
+        hits = index.store.query([vector.tolist()], 1)[0] if vector is not None else []
+        # Duplicate chunks tie, so check the score rather than the id; int8 vectors lose a little precision.
+        if not hits or hits[0]["score"] < 0.98:
+            raise RuntimeError(f"Index version {index.name} failed validation: chunk '{chunk_id}' does not find itself")
+        if index.lexical is not None and tokenize(text) and not index.lexical.search(text, 1):
+            raise RuntimeError(f"Lexical index of version {index.name} failed validation on chunk '{chunk_id}'")
+
+    def _promote(self, index: IndexVersion, files: Dict[str, Dict[str, Any]]) -> None:
+        with self._swap_lock:
+            # The manifest names the live version, so this one atomic replace is the switch for other processes.
+            self._write_manifest(files, index)
+            self._manifest_mtime = self._manifest_stat()
+            previous = self._swap(index)
+        logger.info("Promoted index version %s", index.name)
+        if previous is not None:
+            self._retire(previous)
 
-    def rebuild(self, source_dir: pathlib.Path) -> int:
+    def _swap(self, index: IndexVersion) -> Optional[IndexVersion]:
         with self._lock:
-            if self.config.collection_name in {col.name for col in self._client.list_collections()}:
-                logger.info("Resetting collection '%s'", self.config.collection_name)
-                self._client.delete_collection(name=self.config.collection_name)
-            self._collection = self._client.create_collection(
-                name=self.config.collection_name, embedding_function=self._embedding_fn
+            previous, self._index = self._index, index
+            self.generation += 1
+            index.generation = self.generation
+            if previous is not None:
+                previous.retired = True
+        return previous
+
+    def _retire(self, index: IndexVersion) -> None:
+        with self._lock:
+            drained = index.readers == 0
+        if drained:
+            self._schedule_drop(index)
+
+    def _schedule_drop(self, index: IndexVersion) -> None:
+        # The grace period lets another process serving this index (the API, during a CLI ingest) follow the switch.
+        grace = self.config.index_gc_grace_seconds
+        if grace <= 0:
+            self._drop(index)
+            return
+        timer = threading.Timer(grace, self._drop, (index,))
+        timer.daemon = True
+        timer.start()
+
+    def _drop(self, index: IndexVersion) -> None:
+        current = self._index
+        if current is not None and current is not index and current.name == index.name:
+            return
+        logger.info("Removing index version %s", index.name or "(unversioned)")
+        try:
+            index.store.drop()
+        except Exception as exc:  # pragma: no cover - best effort; the next startup sweeps leftovers
+            logger.warning("Could not remove vectors of index version %s: %s", index.name, exc)
+        # Best effort: on Windows files can stay mapped until the last reader lets go.
+        shutil.rmtree(
+            self._lexical_root(None) if index.name is None else version_dir(self.config.index_dir, index.name),
+            ignore_errors=True,
+        )
+
+    def _sweep_versions(self) -> None:
+        """Remove versions older than the live one, left behind by a crash or an exited ingest process."""
+        active = self._index.name
+        if active is None:
+            return
+        path = self.config.index_dir / MANIFEST_NAME
+        # Another process may still be reading the version this one replaced.
+        if time.time() - path.stat().st_mtime < self.config.index_gc_grace_seconds:
+            return
+        config = self.config
+        for name in list_versions(config.index_dir, config.vector_store, config.collection_name):
+            # Newer versions may be rebuilds still in progress in another process.
+            if name != active and _version_age_key(name) < _version_age_key(active):
+                self._drop(self._open_version(name))
+
+    def _follow_manifest(self) -> None:
+        """Switch to a version promoted by another process, e.g. ``python -m app.ingest`` while the API runs."""
+        now = time.monotonic()
+        if now - self._manifest_checked < VERSION_CHECK_SECONDS or not self._swap_lock.acquire(blocking=False):
+            return
+        try:
+            self._manifest_checked = now
+            mtime = self._manifest_stat()
+            if mtime == self._manifest_mtime:
+                return
+            self._manifest_mtime = mtime
+            name, revision = self._manifest_version(self._load_manifest())
+            current = self._index
+            if (name, revision) == (current.name, current.revision):
+                return
+            if name == current.name:
+                # Updated in place: the numpy store and lexical index were republished to new directories.
+                logger.info("Index version %s was updated by another process; reopening it", name)
+            else:
+                logger.info("Index version %s was promoted by another process; switching to it", name)
+            previous = self._swap(self._open_version(name, revision))
+        finally:
+            self._swap_lock.release()
+        self._retire(previous)
+
+    def _acquire(self) -> Tuple[IndexVersion, int]:
+        """Pin the live version for a search, with its generation as of now (an in-place update may bump it later)."""
+        self._follow_manifest()
+        with self._lock:
+            index = self._index
+            index.readers += 1
+            return index, index.generation
+
+    def _release(self, index: IndexVersion) -> None:
+        with self._lock:
+            index.readers -= 1
+            drained = index.retired and index.readers == 0
+        if drained:
+            self._schedule_drop(index)
+
+    def _update(self, index: IndexVersion, source_dir: pathlib.Path, previous: Dict[str, Dict[str, Any]]) -> int:
+        """Apply file changes to the live version in place; queries see each file's chunks change as it is written."""
+        store = index.store
+        current = {str(path.relative_to(source_dir)): path for path in utils.iter_text_files(source_dir)}
+        files: Dict[str, Dict[str, Any]] = {}
+        progress = self.progress = IngestProgress()
+
+        for rel in sorted(set(previous) - set(current)):
+            logger.info("Removing chunks for deleted file '%s'", rel)
+            store.delete(source=rel)
+
+        def records() -> Iterator[Record]:
+            jobs = ((path, previous.get(rel, {}).get("sha256")) for rel, path in sorted(current.items()))
+            for path, digest, chunks in self._chunk_files(jobs):
+                rel = str(path.relative_to(source_dir))
+                old = previous.get(rel)
+                if chunks is None:
+                    files[rel] = old
+                    continue
+
+                logger.info("Re-embedding %d chunks for %s file '%s'", len(chunks), "changed" if old else "new", rel)
+                # Ids past the new chunk count will not be overwritten, so drop them up front.
+                stale = [f"{rel}::{idx}" for idx in range(len(chunks), old.get("chunks", 0) if old else 0)]
+                if stale:
+                    store.delete(ids=stale)
+                files[rel] = {"sha256": digest, "chunks": len(chunks)}
+                progress.files += 1
+                for idx, chunk in enumerate(chunks):
+                    yield f"{rel}::{idx}", chunk.text, {"source": rel, **chunk.metadata()}
+
+        written = self._write_batches(store, store.upsert, records(), progress)
+        store.flush()
+        changed = files != previous
+        if self.config.hybrid and (changed or index.lexical is None):
+            self._refresh_lexical_index(index)
+            changed = True
+        with self._swap_lock:
+            # A new revision tells other processes serving this version to reopen it.
+            index.revision += changed
+            self._write_manifest(files, index)
+            self._manifest_mtime = self._manifest_stat()
+        if changed:
+            with self._lock:
+                self.generation += 1
+                index.generation = self.generation
+        logger.info("Incremental ingest wrote %d chunks (%d files tracked)", written, len(files))
+        return written
+
+    def _write_batches(
+        self, store: VectorStore, write: Callable[..., Any], records: Iterator[Record], progress: "IngestProgress"
+    ) -> int:
+        batch_size = self.config.embed_batch_size
+        if store.max_batch_size is not None:
+            batch_size = min(batch_size, store.max_batch_size)
+        if batch_size <= 0:
+            raise ValueError("embedding.batch_size must be positive")
+
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            ids, documents, metadatas = (list(column) for column in zip(*batch))
+            write(ids=ids, documents=documents, metadatas=metadatas, embeddings=self._embedding_fn(documents))
+            progress.chunks += len(batch)
+            progress.report()
+
+        progress.report(final=True)
+        return progress.chunks
+
+    def _chunk_files(
+        self, jobs: Iterator[Tuple[pathlib.Path, Optional[str]]]
+    ) -> Iterator[Tuple[pathlib.Path, str, Optional[List[Chunk]]]]:
+        if self._chunker is None:
+            self._chunker = self._build_chunker()
+        return utils.chunk_files(
+            jobs,
+            self._chunker,
+            workers=self.config.ingest_workers,
+            queue_size=self.config.ingest_queue_size,
+        )
+
+    def _build_chunker(self) -> Chunker:
+        config = self.config
+        if config.chunker != "structured":
+            return Chunker(config.chunker, config.chunk_size, config.chunk_overlap)
+        cache_dir = str(config.cache_dir) if config.cache_dir else None
+        onnx_path = config.onnx_path if config.embedding_backend == "onnx" else None
+        try:
+            path: Optional[str] = str(
+                tokenizer_file(config.embedding_model, onnx_path, cache_dir, config.local_files_only)
+            )
+            limit = model_max_tokens(path)
+        except Exception as exc:  # pragma: no cover - runtime guardrail
+            logger.warning(
+                "Could not load the tokenizer of '%s' (%s); approximating chunk sizes from words and punctuation",
+                config.embedding_model,
+                exc,
             )
-            collection = self._collection
-
-        documents: Documents = []
-        metadatas: Metadatas = []
-        ids: List[str] = []
-
-        for path in utils.iter_text_files(source_dir):
-            raw_text = utils.read_text_file(path)
-            chunks = utils.chunk_text(
-                raw_text,
-                chunk_size=self.config.chunk_size,
-                chunk_overlap=self.config.chunk_overlap,
+            path, limit = None, None
+        chunk_size = config.chunk_size
+        if limit and chunk_size > limit - SPECIAL_TOKENS:
+            logger.warning(
+                "retrieval.chunk_size %d exceeds the embedding model's %d-token input; using %d",
+                chunk_size,
+                limit,
+                limit - SPECIAL_TOKENS,
             )
-            for idx, chunk in enumerate(chunks):
-                rel = path.relative_to(source_dir)
-                documents.append(chunk)
-                metadatas.append({"source": str(rel)})
-                ids.append(f"{rel}::{idx}")
+            chunk_size = limit - SPECIAL_TOKENS
+        return Chunker("structured", chunk_size, config.chunk_overlap, path)
 
-        if not documents:
-            logger.warning("No documents found under %s; skipping ingestion", source_dir)
-            return 0
+    def _manifest_params(self) -> Dict[str, Any]:
+        return {
+            "embedding_model": self.config.embedding_model,
+            "embedding_variant": embedding_variant(self.config.embedding_backend, self.config.embedding_quantized),
+            "chunker": self.config.chunker,
+            "chunk_size": self.config.chunk_size,
+            "chunk_overlap": self.config.chunk_overlap,
+            "vector_store": self.config.vector_store,
+            "vector_dtype": self.config.vector_dtype,
+        }
 
-        logger.info("Adding %d chunks to collection '%s'", len(documents), self.config.collection_name)
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
-        return len(documents)
+    def _load_manifest(self) -> Optional[Dict[str, Any]]:
+        path = self.config.index_dir / MANIFEST_NAME
+        if not path.exists():
+            return None
+        try:
+            with path.open("r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable manifest %s: %s", path, exc)
+            return None
 
-    def retrieve(self, query: str) -> Sequence[dict]:
-        with self._lock:
-            if self._collection is None:
-                self._collection = ensure_collection(self._client, self.config.collection_name, self._embedding_fn)
-            collection = self._collection
+    def _write_manifest(self, files: Dict[str, Dict[str, Any]], index: IndexVersion) -> None:
+        path = self.config.index_dir / MANIFEST_NAME
+        tmp = path.with_suffix(".tmp")
+        payload = {
+            "params": self._manifest_params(),
+            "files": files,
+            "version": index.name,
+            "revision": index.revision,
+        }
+        with tmp.open("w", encoding="utf-8") as handle:
+            json.dump(payload, handle, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _manifest_version(manifest: Optional[Dict[str, Any]]) -> Tuple[Optional[str], int]:
+        if manifest is None:
+            return None, 0
+        return manifest.get("version"), manifest.get("revision", 0)
+
+    def _manifest_stat(self) -> Optional[int]:
+        try:
+            return (self.config.index_dir / MANIFEST_NAME).stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def embed_query(self, query: str) -> List[float]:
+        self.load()
+        embedding = self._embedding_cache.get(query)
+        if embedding is None:
+            with metrics.timed("embed"):
+                if self._query_batcher is not None:
+                    embedding = self._query_batcher.embed(query)
+                else:
+                    embedding = self._embedding_fn([query])[0]
+            self._embedding_cache.put(query, embedding)
+        return embedding
+
+    def embed_queries(self, queries: Sequence[str]) -> Embeddings:
+        """Embed many queries in one forward pass, reusing cached embeddings where possible."""
+        self.load()
+        embeddings: List[Optional[List[float]]] = [self._embedding_cache.get(query) for query in queries]
+        missing = sorted({query for query, embedding in zip(queries, embeddings) if embedding is None})
+        if missing:
+            with metrics.timed("embed"):
+                fresh = dict(zip(missing, self._embedding_fn(missing)))
+            for query, embedding in fresh.items():
+                self._embedding_cache.put(query, embedding)
+            embeddings = [
+                embedding if embedding is not None else fresh[query] for query, embedding in zip(queries, embeddings)
+            ]
+        return embeddings  # type: ignore[return-value]
 
-        results = collection.query(query_texts=[query], n_results=self.config.top_k)
-        hits = []
-        for doc, meta in zip(results.get("documents", [[]])[0], results.get("metadatas", [[]])[0]):
-            hits.append({"text": doc, "source": meta.get("source", "unknown")})
-        return hits
+    def retrieve(self, query: str, embedding: Optional[List[float]] = None) -> Sequence[dict]:
+        if embedding is None:
+            embedding = self.embed_query(query)
+        return self._search([query], [embedding])[0]
+
+    def retrieve_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        """Retrieve for many queries with one embedding batch and one multi-query vector search."""
+        return self._search(queries, self.embed_queries(queries))
+
+    def _search(self, queries: Sequence[str], embeddings: Embeddings) -> List[List[dict]]:
+        index, generation = self._acquire()
+        try:
+            return self._search_version(index, generation, queries, embeddings)
+        finally:
+            self._release(index)
+
+    def _search_version(
+        self, index: IndexVersion, generation: int, queries: Sequence[str], embeddings: Embeddings
+    ) -> List[List[dict]]:
+        lexical = index.lexical
+        results: List[Optional[List[dict]]] = []
+        keys = []
+        for query, embedding in zip(queries, embeddings):
+            key = (tuple(embedding), tuple(tokenize(query)) if lexical else (), self.config.top_k, generation)
+            cached = self._result_cache.get(key)
+            results.append([dict(hit) for hit in cached] if cached is not None else None)
+            keys.append(key)
+
+        pending = [number for number, hits in enumerate(results) if hits is None]
+        if pending:
+            top_k = self.config.top_k
+            reranker = index.reranker
+            # Over-fetch so the reranker has a candidate pool to choose the final top_k from.
+            pool = max(top_k, self.config.rerank_candidates) if reranker is not None else top_k
+            n_results = max(pool, self.config.lexical_candidates) if lexical else pool
+            with metrics.timed("vector_query"):
+                found = index.store.query([embeddings[number] for number in pending], n_results)
+            budget = self.config.rerank_budget_ms
+            for number, hits in zip(pending, found):
+                if lexical is not None:
+                    with metrics.timed("lexical"):
+                        hits = self._fuse_lexical(queries[number], hits, index.store, lexical, pool)
+                reranked = None
+                if reranker is not None and hits:
+                    # Each question's budget starts with its own rerank, so batch size and queueing for the
+                    # embedder do not use it up before reranking begins.
+                    deadline = time.perf_counter() + budget / 1000.0 if budget else float("inf")
+                    with metrics.timed("rerank"):
+                        reranked = reranker.rerank(queries[number], embeddings[number], hits[:pool], top_k, deadline)
+                    if reranked is None:
+                        RERANKS_SKIPPED.inc()
+                        logger.debug("Rerank budget of %sms spent; keeping retrieval order", budget)
+                hits = (reranked if reranked is not None else hits)[:top_k]
+                # A skipped rerank is not cached, so the next identical question gets the reranked hits.
+                if reranker is None or reranked is not None:
+                    self._result_cache.put(keys[number], [dict(hit) for hit in hits])
+                results[number] = hits
+        return results  # type: ignore[return-value]
+
+    def _fuse_lexical(
+        self, query: str, vector_hits: List[dict], store: VectorStore, lexical: LexicalIndex, limit: int
+    ) -> List[dict]:
+        lexical_ids = [chunk_id for chunk_id, _ in lexical.search(query, self.config.lexical_candidates)]
+        fused = reciprocal_rank_fusion([[hit["id"] for hit in vector_hits], lexical_ids], k=self.config.rrf_k)
+        fused = fused[:limit]
+        by_id = {hit["id"]: hit for hit in vector_hits}
+        missing = [chunk_id for chunk_id in fused if chunk_id not in by_id]
+        for hit in store.get(missing):
+            by_id[hit["id"]] = hit
+        return [by_id[chunk_id] for chunk_id in fused if chunk_id in by_id]
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {"embeddings": self._embedding_cache.stats(), "results": self._result_cache.stats()}
+
+    async def _run_query_task(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context so per-request timings see stages timed on the worker.
+        return await loop.run_in_executor(self._query_executor, contextvars.copy_context().run, fn, *args)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        return await self._run_query_task(self.embed_query, query)
+
+    async def aretrieve(self, query: str, embedding: Optional[List[float]] = None) -> Sequence[dict]:
+        return await self._run_query_task(self.retrieve, query, embedding)
+
+    async def aretrieve_many(self, queries: Sequence[str]) -> List[List[dict]]:
+        return await self._run_query_task(self.retrieve_many, queries)
 
     @staticmethod
-    def build_prompt(question: str, hits: Sequence[dict]) -> str:
+    def build_prompt(question: str, hits: Sequence[dict], sort_context: bool = False) -> str:
+        """
+        Build the user message; instructions live in SYSTEM_PROMPT. With ``sort_context`` the
+        blocks are ordered by (source, chunk) so repeated hits yield identical prompt prefixes.
+        """
+        if sort_context:
+            hits = sorted(hits, key=chunk_position)
         context_blocks = []
         for hit in hits:
             context_blocks.append(f"Source: {hit['source']}\n{hit['text']}")
         context = "\n\n".join(context_blocks)
-        return (
-            "You are a helpful bonsai assistant. Use only the provided context. "
-            "If the answer is not in the context, say you don't know.\n\n"
-            f"Context:\n{context}\n\nQuestion: {question}\nAnswer:"
-        )
+        return f"Context:\n{context}\n\nQuestion: {question}\nAnswer:"
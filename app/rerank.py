@@ -0,0 +1,101 @@
+import logging
+import time
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+logger = logging.getLogger(__name__)
+
+RERANKERS = ("none", "mmr", "cross-encoder")
+
+
+def mmr(query: np.ndarray, candidates: np.ndarray, k: int, diversity: float) -> List[int]:
+    """
+    Maximal marginal relevance over unit vectors: greedily pick the candidate maximising
+    ``(1 - diversity) * sim(query) - diversity * max sim(already picked)``.
+    """
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    picked: List[int] = []
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    remaining = np.ones(len(candidates), dtype=bool)
+    for _ in range(min(k, len(candidates))):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = np.where(remaining, (1.0 - diversity) * relevance - diversity * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+class Reranker:
+    """Re-order an over-fetched candidate list, or return None to leave it alone (budget spent)."""
+
+    def rerank(
+        self, query: str, query_embedding: Sequence[float], hits: List[dict], k: int, deadline: float
+    ) -> Optional[List[dict]]:
+        raise NotImplementedError
+
+
+class MMRReranker(Reranker):
+    """Diversity pass over the stored chunk vectors, so near-duplicate chunks stop crowding out the top k."""
+
+    def __init__(self, get_embeddings: Callable[[Sequence[str]], Dict[str, np.ndarray]], diversity: float) -> None:
+        self._get_embeddings = get_embeddings
+        self.diversity = diversity
+
+    def rerank(self, query, query_embedding, hits, k, deadline):
+        if time.perf_counter() >= deadline:
+            return None
+        vectors = self._get_embeddings([hit["id"] for hit in hits])
+        hits = [hit for hit in hits if hit["id"] in vectors]
+        if not hits:
+            return None
+        matrix = np.stack([vectors[hit["id"]] for hit in hits]).astype(np.float32)
+        picked = mmr(np.asarray(query_embedding, dtype=np.float32), matrix, k, self.diversity)
+        return [hits[number] for number in picked]
+
+
+class CrossEncoderReranker(Reranker):
+    """Score (question, chunk) pairs with a small cross-encoder, sizing the pool to the time left."""
+
+    def __init__(self, model_name: str, device: str, cache_dir: Optional[str], local_files_only: bool) -> None:
+        # Imported here for the same reason as the embedding model: torch is slow to import.
+        from sentence_transformers import CrossEncoder
+
+        logger.info("Loading cross-encoder '%s' on device '%s'", model_name, device)
+        cache_args = {"cache_dir": cache_dir} if cache_dir else {}
+        self.model: "CrossEncoder" = CrossEncoder(
+            model_name,
+            device=device,
+            local_files_only=local_files_only,
+            tokenizer_args=cache_args,
+            automodel_args=cache_args,
+        )
+        # Moving average of seconds per scored pair, used to predict whether a pool fits the budget.
+        self._seconds_per_pair: Optional[float] = None
+        self._lock = Lock()
+
+    def rerank(self, query, query_embedding, hits, k, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0 or not hits:
+            return None
+        pool = len(hits)
+        if self._seconds_per_pair:
+            pool = min(pool, int(remaining / self._seconds_per_pair))
+        if pool < min(k, len(hits)):
+            return None
+        candidates = hits[:pool]
+        started = time.perf_counter()
+        scores = self.model.predict([(query, hit["text"]) for hit in candidates], show_progress_bar=False)
+        per_pair = (time.perf_counter() - started) / len(candidates)
+        with self._lock:
+            previous = self._seconds_per_pair
+            self._seconds_per_pair = per_pair if previous is None else 0.8 * previous + 0.2 * per_pair
+        order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:k]
+        return [dict(candidates[number], rerank_score=float(scores[number])) for number in order]
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from app import metrics
+from app.cache import LRUCache
+from app.llm import LlamaTokenCounter
+
+logger = logging.getLogger(__name__)
+
+FOLLOW_UP_REUSES = metrics.REGISTRY.counter(
+    "bonsai_follow_up_reuses_total", "Follow-up questions answered from the previous turn's retrieved context."
+)
+
+# Role markers and separators the chat template adds around each history message.
+TURN_OVERHEAD_TOKENS = 8
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+    # Retrieved (pre-packing) hits, kept so a close follow-up can reuse them without a new search.
+    hits: List[dict]
+    embedding: Optional[List[float]] = None
+    generation: int = 0
+
+
+@dataclass
+class Session:
+    session_id: str
+    turns: List[Turn] = field(default_factory=list)
+    updated_at: float = field(default_factory=time.time)
+
+
+class SessionStore:
+    """
+    Conversation history per session id: an in-memory LRU with a TTL, optionally spilling
+    sessions evicted for capacity to ``spill_dir`` so they can be picked up again later.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        ttl_seconds: Optional[float],
+        max_turns: int,
+        spill_dir: Optional[pathlib.Path] = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.spill_dir = spill_dir
+        self._sessions: LRUCache[Session] = LRUCache(max_sessions, ttl_seconds, on_evict=self._spill)
+        if spill_dir is not None:
+            spill_dir.mkdir(parents=True, exist_ok=True)
+            self._prune_spilled()
+
+    def _spill_path(self, session_id: str) -> pathlib.Path:
+        # Hashed so arbitrary client-chosen ids cannot escape the spill directory.
+        return self.spill_dir / f"{hashlib.sha256(session_id.encode('utf-8')).hexdigest()}.json"
+
+    def _spill(self, _: Hashable, session: Session) -> None:
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(session.session_id)
+        tmp = path.with_suffix(".tmp")
+        try:
+            with tmp.open("w", encoding="utf-8") as handle:
+                json.dump(asdict(session), handle)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logger.warning("Could not spill session %s to %s: %s", session.session_id, path, exc)
+
+    def _expired(self, updated_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - updated_at > self.ttl_seconds
+
+    def _load_spilled(self, session_id: str) -> Optional[Session]:
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(session_id)
+        try:
+            with path.open("r", encoding="utf-8") as handle:
+                data = json.load(handle)
+            path.unlink()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable spilled session %s: %s", path, exc)
+            return None
+        session = Session(
+            session_id=data["session_id"],
+            turns=[Turn(**turn) for turn in data["turns"]],
+            updated_at=data["updated_at"],
+        )
+        return None if self._expired(session.updated_at) else session
+
+    def _prune_spilled(self) -> None:
+        for path in self.spill_dir.glob("*.json"):
+            try:
+                if self._expired(path.stat().st_mtime):
+                    path.unlink()
+            except OSError:
+                continue
+
+    def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load_spilled(session_id)
+            if session is not None:
+                self._sessions.put(session_id, session)
+        return session
+
+    def append(self, session_id: str, turn: Turn) -> None:
+        session = self.get(session_id) or Session(session_id)
+        session.turns = (session.turns + [turn])[-self.max_turns :]
+        session.updated_at = time.time()
+        # Re-put to refresh both the LRU position and the TTL.
+        self._sessions.put(session_id, session)
+
+    def delete(self, session_id: str) -> bool:
+        found = self._sessions.pop(session_id) is not None
+        if self.spill_dir is not None:
+            path = self._spill_path(session_id)
+            if path.exists():
+                path.unlink()
+                found = True
+        return found
+
+    def spill_all(self) -> None:
+        """Write every live session to the spill directory, e.g. on shutdown."""
+        for key, session in self._sessions.items():
+            self._spill(key, session)
+
+    def stats(self) -> dict:
+        return self._sessions.stats()
+
+
+def is_follow_up(previous: Turn, embedding: Sequence[float], generation: int, threshold: Optional[float]) -> bool:
+    """Whether a question is close enough to the previous turn to answer from the same hits."""
+    if threshold is None or previous.embedding is None or previous.generation != generation or not previous.hits:
+        return False
+    similarity = float(np.dot(np.asarray(previous.embedding), np.asarray(embedding)))
+    return similarity >= threshold
+
+
+async def select_history(
+    turns: Sequence[Turn], counter: LlamaTokenCounter, budget_tokens: int, client: Optional[httpx.AsyncClient]
+) -> Tuple[List[Tuple[str, str]], int]:
+    """
+    Most recent (question, answer) pairs that fit ``budget_tokens``; older turns are dropped.
+    Returns the pairs oldest first, and the tokens they use.
+    """
+    selected: List[Tuple[str, str]] = []
+    used = 0
+    for turn in reversed(turns):
+        cost = (
+            await counter.count(turn.question, client)
+            + await counter.count(turn.answer, client)
+            + 2 * TURN_OVERHEAD_TOKENS
+        )
+        if used + cost > budget_tokens:
+            break
+        selected.append((turn.question, turn.answer))
+        used += cost
+    selected.reverse()
+    return selected, used
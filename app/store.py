@@ -0,0 +1,426 @@
+import itertools
+import json
+import logging
+import os
+import pathlib
+import shutil
+import time
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app import utils
+
+logger = logging.getLogger(__name__)
+
+NUMPY_STORE_DIR = "vectors"
+# Index versions built by full rebuilds; see RAGPipeline. Chroma keeps them as suffixed collections instead.
+VERSIONS_DIR = "versions"
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+# Rows scored per matrix product in NumpyStore, bounding the float32 temporaries for float16/int8 stores.
+# Also the rows copied at a time when flush carries existing vectors into a new version.
+_QUERY_BLOCK_ROWS = 16384
+
+
+def _hit(chunk_id: str, document: Optional[str], metadata: Optional[Dict[str, Any]], score: float) -> dict:
+    return {"id": chunk_id, "text": document or "", "source": "unknown", **(metadata or {}), "score": score}
+
+
+class VectorStore:
+    """
+    What RAGPipeline needs from a vector index. Embeddings are always supplied by the caller and
+    are L2-normalised, so scores are cosine similarities. Writes may be staged until ``flush``.
+    """
+
+    max_batch_size: Optional[int] = None
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict], embeddings: List[List[float]]) -> None:
+        raise NotImplementedError
+
+    def upsert(
+        self, ids: List[str], documents: List[str], metadatas: List[dict], embeddings: List[List[float]]
+    ) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids: Optional[Sequence[str]] = None, source: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def query(self, embeddings: Sequence[Sequence[float]], n_results: int) -> List[List[dict]]:
+        """Top ``n_results`` hits (id, text, metadata fields, score) for each query embedding."""
+        raise NotImplementedError
+
+    def get(self, ids: Sequence[str]) -> List[dict]:
+        raise NotImplementedError
+
+    def get_embeddings(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Stored (unit) vectors for ``ids``; unknown ids are left out."""
+        raise NotImplementedError
+
+    def iter_documents(self, page_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        """Yield (chunk id, source, text) for every stored chunk."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def drop(self) -> None:
+        """Delete everything this store holds, including its files."""
+        raise NotImplementedError
+
+
+def build_client(index_dir: pathlib.Path):
+    # Silence Chroma telemetry warnings/errors in constrained environments.
+    os.environ.setdefault("CHROMA_TELEMETRY_ENABLED", "false")
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    # Imported lazily so the NumPy backend never pays for chromadb's import.
+    import chromadb
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    return chromadb.PersistentClient(path=str(index_dir))
+
+
+def ensure_collection(client, name: str):
+    if name in {col.name for col in client.list_collections()}:
+        return client.get_collection(name=name, embedding_function=None)
+    return client.create_collection(name=name, embedding_function=None)
+
+
+class ChromaStore(VectorStore):
+    def __init__(self, index_dir: pathlib.Path, collection_name: str) -> None:
+        self.collection_name = collection_name
+        self._client = build_client(index_dir)
+        self._collection = ensure_collection(self._client, collection_name)
+        get_max_batch_size = getattr(self._client, "get_max_batch_size", None)
+        self.max_batch_size = get_max_batch_size() if get_max_batch_size is not None else None
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def reset(self) -> None:
+        if self.collection_name in {col.name for col in self._client.list_collections()}:
+            logger.info("Resetting collection '%s'", self.collection_name)
+            self._client.delete_collection(name=self.collection_name)
+        self._collection = self._client.create_collection(name=self.collection_name, embedding_function=None)
+
+    def drop(self) -> None:
+        if self.collection_name in {col.name for col in self._client.list_collections()}:
+            self._client.delete_collection(name=self.collection_name)
+
+    def add(self, ids, documents, metadatas, embeddings) -> None:
+        self._collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def upsert(self, ids, documents, metadatas, embeddings) -> None:
+        self._collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def delete(self, ids: Optional[Sequence[str]] = None, source: Optional[str] = None) -> None:
+        if ids:
+            self._collection.delete(ids=list(ids))
+        if source is not None:
+            self._collection.delete(where={"source": source})
+
+    def query(self, embeddings: Sequence[Sequence[float]], n_results: int) -> List[List[dict]]:
+        results = self._collection.query(
+            query_embeddings=[list(embedding) for embedding in embeddings],
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+        hits = []
+        for ids, docs, metas, distances in zip(
+            results["ids"], results["documents"], results["metadatas"], results["distances"]
+        ):
+            # Default l2 space: ||a - b||^2 = 2 - 2cos for unit vectors.
+            hits.append([_hit(i, d, m, 1.0 - dist / 2.0) for i, d, m, dist in zip(ids, docs, metas, distances)])
+        return hits
+
+    def get(self, ids: Sequence[str]) -> List[dict]:
+        if not ids:
+            return []
+        found = self._collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return [_hit(i, d, m, 0.0) for i, d, m in zip(found["ids"], found["documents"], found["metadatas"])]
+
+    def get_embeddings(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        if not ids:
+            return {}
+        found = self._collection.get(ids=list(ids), include=["embeddings"])
+        return {i: np.asarray(e, dtype=np.float32) for i, e in zip(found["ids"], found["embeddings"])}
+
+    def iter_documents(self, page_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        offset = 0
+        while True:
+            page = self._collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            for chunk_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                yield chunk_id, (meta or {}).get("source", "unknown"), doc or ""
+            offset += len(page["ids"])
+
+
+class NumpyStore(VectorStore):
+    """
+    Brute-force store: one memory-mapped ``vectors.npy`` matrix (float32, float16 or per-row
+    scaled int8) plus a ``records.json`` sidecar of ids, documents and metadata. Written vectors
+    are staged on disk, one shard per batch, and ``flush`` streams the kept and staged rows into
+    a new version directory and publishes it, so queries keep reading the previous version until
+    then and memory stays bounded by the batch size rather than the corpus.
+    """
+
+    def __init__(self, root: pathlib.Path, dtype: str = "float32") -> None:
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"vector_dtype must be one of {', '.join(VECTOR_DTYPES)}; got '{dtype}'")
+        self.root = root
+        self.dtype = dtype
+        self._lock = Lock()
+        self._records: List[dict] = []
+        self._positions: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._reset_pending = False
+        # id -> (document, metadata, staged shard, row in that shard)
+        self._pending: Dict[str, Tuple[str, dict, int, int]] = {}
+        self._staging: Optional[pathlib.Path] = None
+        self._shards = 0
+        self._deleted_ids: set = set()
+        self._deleted_sources: set = set()
+        self._open()
+
+    def _open(self) -> None:
+        directory = utils.current_version(self.root)
+        if directory is None or not (directory / "records.json").exists():
+            return
+        with (directory / "records.json").open("r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        if payload.get("dtype", "float32") != self.dtype:
+            logger.warning(
+                "Vector store at %s was written as %s but data.vector_dtype is '%s'; treating it as empty "
+                "until the next ingest rebuilds it",
+                directory,
+                payload.get("dtype"),
+                self.dtype,
+            )
+            return
+        vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+        scales = np.load(directory / "scales.npy", mmap_mode="r") if self.dtype == "int8" else None
+        with self._lock:
+            self._records = payload["records"]
+            self._positions = {record["id"]: number for number, record in enumerate(self._records)}
+            self._vectors = vectors
+            self._scales = scales
+
+    def count(self) -> int:
+        return len(self._records)
+
+    def reset(self) -> None:
+        self._reset_pending = True
+        self._clear_staging()
+        self._deleted_ids.clear()
+        self._deleted_sources.clear()
+
+    def add(self, ids, documents, metadatas, embeddings) -> None:
+        self.upsert(ids, documents, metadatas, embeddings)
+
+    def upsert(self, ids, documents, metadatas, embeddings) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if not len(vectors):
+            return
+        shard = self._stage(vectors)
+        for row, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            self._deleted_ids.discard(chunk_id)
+            self._pending[chunk_id] = (document, dict(metadata or {}), shard, row)
+
+    def _stage(self, vectors: np.ndarray) -> int:
+        if self._staging is None:
+            # Inside root, so a crashed ingest's leftovers go when a full rebuild retires this index version.
+            self._staging = self.root / f"staging-{time.time_ns()}"
+            self._staging.mkdir(parents=True)
+        np.save(self._staging / f"{self._shards}.npy", vectors)
+        self._shards += 1
+        return self._shards - 1
+
+    def _clear_staging(self) -> None:
+        if self._staging is not None:
+            shutil.rmtree(self._staging, ignore_errors=True)
+        self._staging = None
+        self._shards = 0
+        self._pending.clear()
+
+    def delete(self, ids: Optional[Sequence[str]] = None, source: Optional[str] = None) -> None:
+        for chunk_id in ids or ():
+            self._pending.pop(chunk_id, None)
+            self._deleted_ids.add(chunk_id)
+        if source is not None:
+            self._deleted_sources.add(source)
+            for chunk_id in [key for key, (_, meta, *_) in self._pending.items() if meta.get("source") == source]:
+                del self._pending[chunk_id]
+
+    def _quantize(self, matrix: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales[scales == 0] = 1.0
+            return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return matrix.astype(self.dtype), None
+
+    @staticmethod
+    def _rows(vectors: np.ndarray, scales: Optional[np.ndarray], start: int, stop: int) -> np.ndarray:
+        block = np.array(vectors[start:stop], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[start:stop])[:, None]
+        return block
+
+    def flush(self) -> None:
+        if not (self._reset_pending or self._pending or self._deleted_ids or self._deleted_sources):
+            return
+        keep: List[int] = []
+        if not self._reset_pending and self._vectors is not None:
+            keep = [
+                number
+                for number, record in enumerate(self._records)
+                if record["id"] not in self._pending
+                and record["id"] not in self._deleted_ids
+                and record["meta"].get("source") not in self._deleted_sources
+            ]
+        records = [self._records[number] for number in keep]
+        # Grouped by shard, so each staged shard is read once.
+        staged = sorted(self._pending.items(), key=lambda item: item[1][2:])
+        records.extend(
+            {"id": chunk_id, "text": document, "meta": metadata} for chunk_id, (document, metadata, *_) in staged
+        )
+
+        if staged:
+            dimension = np.load(self._staging / f"{staged[0][1][2]}.npy", mmap_mode="r").shape[1]
+        else:
+            dimension = self._vectors.shape[1] if keep else 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        directory = utils.new_version_dir(self.root)
+        if records:
+            stored = np.lib.format.open_memmap(
+                directory / "vectors.npy", mode="w+", dtype=np.dtype(self.dtype), shape=(len(records), dimension)
+            )
+            scales = np.ones(len(records), dtype=np.float32) if self.dtype == "int8" else None
+            position = 0
+            # Existing rows are already in this dtype, so they are copied as stored, block by block.
+            for start in range(0, len(keep), _QUERY_BLOCK_ROWS):
+                rows = np.asarray(keep[start : start + _QUERY_BLOCK_ROWS])
+                stored[position : position + len(rows)] = self._vectors[rows]
+                if scales is not None:
+                    scales[position : position + len(rows)] = self._scales[rows]
+                position += len(rows)
+            for shard, group in itertools.groupby(staged, key=lambda item: item[1][2]):
+                rows = np.array([row for _, (*_, row) in group])
+                block = np.load(self._staging / f"{shard}.npy", mmap_mode="r")[rows]
+                block, block_scales = self._quantize(np.asarray(block, dtype=np.float32))
+                stored[position : position + len(rows)] = block
+                if scales is not None:
+                    scales[position : position + len(rows)] = block_scales
+                position += len(rows)
+            stored.flush()
+            del stored
+            if scales is not None:
+                np.save(directory / "scales.npy", scales)
+        else:
+            np.save(directory / "vectors.npy", np.zeros((0, 0), dtype=self.dtype))
+            if self.dtype == "int8":
+                np.save(directory / "scales.npy", np.zeros(0, dtype=np.float32))
+        with (directory / "records.json").open("w", encoding="utf-8") as handle:
+            json.dump({"dtype": self.dtype, "records": records}, handle)
+        utils.publish_version(self.root, directory)
+        self._reset_pending = False
+        self._clear_staging()
+        self._deleted_ids.clear()
+        self._deleted_sources.clear()
+        self._open()
+        logger.info("Vector store now holds %d chunks (%s)", len(records), self.dtype)
+
+    def query(self, embeddings: Sequence[Sequence[float]], n_results: int) -> List[List[dict]]:
+        with self._lock:
+            vectors, scales, records = self._vectors, self._scales, self._records
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if vectors is None or not len(records) or n_results <= 0:
+            return [[] for _ in range(len(queries))]
+
+        scores = np.empty((len(records), len(queries)), dtype=np.float32)
+        for start in range(0, len(records), _QUERY_BLOCK_ROWS):
+            stop = min(start + _QUERY_BLOCK_ROWS, len(records))
+            scores[start:stop] = self._rows(vectors, scales, start, stop) @ queries.T
+
+        n_results = min(n_results, len(records))
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, n_results - 1)[:n_results]
+            top = top[np.argsort(-column[top], kind="stable")]
+            results.append(
+                [_hit(records[n]["id"], records[n]["text"], records[n]["meta"], float(column[n])) for n in top]
+            )
+        return results
+
+    def get(self, ids: Sequence[str]) -> List[dict]:
+        with self._lock:
+            records, positions = self._records, self._positions
+        found = [records[positions[chunk_id]] for chunk_id in ids if chunk_id in positions]
+        return [_hit(record["id"], record["text"], record["meta"], 0.0) for record in found]
+
+    def get_embeddings(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            vectors, scales, positions = self._vectors, self._scales, self._positions
+        known = [chunk_id for chunk_id in ids if chunk_id in positions]
+        if vectors is None or not known:
+            return {}
+        rows = np.array([positions[chunk_id] for chunk_id in known])
+        matrix = np.asarray(vectors[rows], dtype=np.float32)
+        if scales is not None:
+            matrix *= np.asarray(scales[rows])[:, None]
+        return dict(zip(known, matrix))
+
+    def iter_documents(self, page_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        for record in self._records:
+            yield record["id"], record["meta"].get("source", "unknown"), record["text"]
+
+    def drop(self) -> None:
+        with self._lock:
+            self._records, self._positions, self._vectors, self._scales = [], {}, None, None
+        self._clear_staging()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def version_dir(index_dir: pathlib.Path, version: Optional[str]) -> pathlib.Path:
+    """Directory holding a version's files; ``None`` is an index written before versioning, kept at the top level."""
+    return index_dir if version is None else index_dir / VERSIONS_DIR / version
+
+
+def build_store(
+    index_dir: pathlib.Path,
+    backend: str,
+    collection_name: str,
+    dtype: str = "float32",
+    version: Optional[str] = None,
+) -> VectorStore:
+    if backend == "chroma":
+        return ChromaStore(index_dir, collection_name if version is None else f"{collection_name}-{version}")
+    if backend == "numpy":
+        return NumpyStore(version_dir(index_dir, version) / NUMPY_STORE_DIR, dtype=dtype)
+    raise ValueError(f"Unknown data.vector_store '{backend}'; expected 'chroma' or 'numpy'")
+
+
+def list_versions(index_dir: pathlib.Path, backend: str, collection_name: str) -> List[Optional[str]]:
+    """Index versions present under ``index_dir``, with ``None`` for an unversioned index."""
+    found: set = set()
+    versions = index_dir / VERSIONS_DIR
+    if versions.is_dir():
+        found.update(path.name for path in versions.iterdir() if path.is_dir())
+    if backend == "chroma":
+        prefix = f"{collection_name}-"
+        for name in (col.name for col in build_client(index_dir).list_collections()):
+            if name == collection_name:
+                found.add(None)
+            elif name.startswith(prefix):
+                found.add(name[len(prefix) :])
+    elif (index_dir / NUMPY_STORE_DIR).is_dir():
+        found.add(None)
+    return list(found)
@@ -1,5 +1,17 @@
+import hashlib
+import multiprocessing
+import os
 import pathlib
-from typing import Iterable, List
+import shutil
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+from app.chunking import Chunk, Chunker
+
+# Cap on the default chunking pool; chunking rarely keeps up with the embedder beyond a few processes.
+MAX_DEFAULT_WORKERS = 4
 
 
 def iter_text_files(root: pathlib.Path) -> Iterable[pathlib.Path]:
@@ -13,21 +25,84 @@ def read_text_file(path: pathlib.Path) -> str:
 
 
 def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
-    if chunk_size <= 0:
-        raise ValueError("chunk_size must be positive")
-    if chunk_overlap < 0:
-        raise ValueError("chunk_overlap must be non-negative")
-    if chunk_overlap >= chunk_size:
-        raise ValueError("chunk_overlap must be smaller than chunk_size to avoid infinite loops")
-
-    sanitized = " ".join(text.split())
-    words = sanitized.split()
-    chunks: List[str] = []
-    start = 0
-    while start < len(words):
-        end = min(len(words), start + chunk_size)
-        chunks.append(" ".join(words[start:end]))
-        if end >= len(words):
-            break
-        start = max(0, end - chunk_overlap)
-    return chunks
+    return [chunk.text for chunk in Chunker("words", chunk_size, chunk_overlap)(text)]
+
+
+def load_and_chunk(
+    path: pathlib.Path, chunker: Chunker, known_digest: Optional[str] = None
+) -> Tuple[str, Optional[List[Chunk]]]:
+    """Hash and chunk one file; chunks are None when the digest matches ``known_digest``."""
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == known_digest:
+        return digest, None
+    return digest, chunker(data.decode("utf-8", errors="ignore"))
+
+
+def chunk_files(
+    jobs: Iterable[Tuple[pathlib.Path, Optional[str]]],
+    chunker: Chunker,
+    workers: int = 0,
+    queue_size: int = 16,
+) -> Iterator[Tuple[pathlib.Path, str, Optional[List[Chunk]]]]:
+    """
+    Read and chunk ``(path, known_digest)`` jobs on a process pool, yielding results in order.
+    At most ``queue_size`` files are read ahead of the consumer, so chunking overlaps with
+    whatever the caller does with each result (embedding) without buffering the corpus.
+    ``workers=0`` means one per CPU core, up to MAX_DEFAULT_WORKERS.
+    """
+    workers = workers or min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+    if workers <= 1:
+        for path, known in jobs:
+            yield (path, *load_and_chunk(path, chunker, known))
+        return
+
+    # Spawned, not forked: /ingest runs inside the API process, and forking it while its query, batcher and
+    # torch threads hold locks can leave a worker deadlocked on a lock copied mid-acquire.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending: Deque[Tuple[pathlib.Path, Future]] = deque()
+        for path, known in jobs:
+            pending.append((path, pool.submit(load_and_chunk, path, chunker, known)))
+            if len(pending) >= max(queue_size, 1):
+                done_path, future = pending.popleft()
+                yield (done_path, *future.result())
+        while pending:
+            done_path, future = pending.popleft()
+            yield (done_path, *future.result())
+
+
+def current_version(root: pathlib.Path, pointer: str = "CURRENT") -> Optional[pathlib.Path]:
+    """Return the versioned subdirectory of ``root`` named by its pointer file, if any."""
+    try:
+        name = (root / pointer).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return root / name if name else None
+
+
+def new_version_dir(root: pathlib.Path) -> pathlib.Path:
+    directory = root / f"v{time.time_ns()}"
+    directory.mkdir(parents=True)
+    return directory
+
+
+def publish_version(root: pathlib.Path, directory: pathlib.Path, pointer: str = "CURRENT") -> None:
+    """
+    Atomically point ``root`` at ``directory`` and remove older versions. Only published-style ``v<ns>``
+    directories older than ``directory`` go: newer ones and anything else (e.g. NumpyStore staging) may
+    belong to a writer in another process. Removal is best effort: on Windows a previous version can
+    still be memory-mapped by an in-flight reader.
+    """
+    target = root / pointer
+    tmp = target.with_suffix(".tmp")
+    tmp.write_text(directory.name, encoding="utf-8")
+    os.replace(tmp, target)
+    published = _version_number(directory.name)
+    for old in root.iterdir():
+        number = _version_number(old.name)
+        if old.is_dir() and number is not None and published is not None and number < published:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def _version_number(name: str) -> Optional[int]:
+    return int(name[1:]) if name.startswith("v") and name[1:].isdigit() else None
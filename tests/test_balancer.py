@@ -0,0 +1,129 @@
+import asyncio
+import socket
+from collections import Counter
+from typing import Iterator, List
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.balancer import Backend, BackendPool
+from app.bench import StubServer, build_stub_llama
+from app.llm import LlamaCPPClient
+
+MODEL = "local-llm"
+
+
+@pytest.fixture(scope="module")
+def stub_bases() -> Iterator[List[str]]:
+    # Two llama-servers with two slots each, answering 5 tokens at 10ms per token.
+    with StubServer(build_stub_llama(MODEL, 10.0, 5, slots=2)) as first:
+        with StubServer(build_stub_llama(MODEL, 10.0, 5, slots=2)) as second:
+            yield [f"http://127.0.0.1:{server.port}/v1" for server in (first, second)]
+
+
+def make_backend(api_base: str, max_concurrency: int = 2, discover_slots: bool = False) -> Backend:
+    client = LlamaCPPClient(api_base=api_base, model_name=MODEL, max_tokens=5, temperature=0.0)
+    return Backend(client=client, max_concurrency=max_concurrency, discover_slots=discover_slots)
+
+
+def closed_port_base() -> str:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def test_routes_to_least_outstanding_backend(stub_bases: List[str]) -> None:
+    pool = BackendPool([make_backend(api_base) for api_base in stub_bases])
+    peak = Counter()
+
+    async def ask(client: httpx.AsyncClient) -> str:
+        async with pool.lease() as backend:
+            peak[backend.name] = max(peak[backend.name], backend.outstanding)
+            await backend.client.generate("Which soil for a juniper?", client)
+            return backend.name
+
+    async def run() -> List[str]:
+        async with httpx.AsyncClient(timeout=10) as client:
+            return await asyncio.gather(*(ask(client) for _ in range(4)))
+
+    used = Counter(asyncio.run(run()))
+    assert used == Counter({stub_bases[0]: 2, stub_bases[1]: 2})
+    assert max(peak.values()) <= 2
+    assert all(backend.outstanding == 0 for backend in pool.backends)
+
+
+def test_rejects_with_retry_after_when_saturated(stub_bases: List[str]) -> None:
+    pool = BackendPool([make_backend(stub_bases[0], max_concurrency=1)], queue_size=0)
+
+    async def run() -> HTTPException:
+        async with pool.lease():
+            with pytest.raises(HTTPException) as rejected:
+                await pool.acquire()
+        return rejected.value
+
+    exc = asyncio.run(run())
+    assert exc.status_code == 503
+    assert int(exc.headers["Retry-After"]) >= 1
+
+
+def test_queued_request_times_out_with_503(stub_bases: List[str]) -> None:
+    pool = BackendPool([make_backend(stub_bases[0], max_concurrency=1)], queue_size=1, queue_timeout_seconds=0.1)
+
+    async def run() -> HTTPException:
+        async with pool.lease():
+            with pytest.raises(HTTPException) as rejected:
+                await pool.acquire()
+        return rejected.value
+
+    assert asyncio.run(run()).status_code == 503
+
+
+def test_health_check_removes_and_restores_backend(stub_bases: List[str]) -> None:
+    live, dead = make_backend(stub_bases[0], discover_slots=True), make_backend(closed_port_base())
+    pool = BackendPool([live, dead])
+
+    async def run() -> None:
+        async with httpx.AsyncClient(timeout=2) as client:
+            await pool.check_health(client)
+            assert live.healthy and not dead.healthy
+            # Slot count is read from the stub's /slots.
+            assert live.max_concurrency == 2 and live.idle_slots == 2
+            for _ in range(3):
+                async with pool.lease() as backend:
+                    assert backend is live
+
+            # A connection failure takes a backend out of rotation once health checks are running...
+            pool._checking = True
+            with pytest.raises(httpx.ConnectError):
+                async with pool.lease():
+                    raise httpx.ConnectError("connection refused")
+            assert not live.healthy
+            with pytest.raises(HTTPException) as rejected:
+                await pool.acquire()
+            assert rejected.value.status_code == 503
+
+            # ...and the next health check brings it back.
+            await pool.check_health(client)
+            assert live.healthy
+            async with pool.lease() as backend:
+                assert backend is live
+
+    asyncio.run(run())
+
+
+def test_slot_affinity_uses_discovered_slot_count(stub_bases: List[str]) -> None:
+    backend = make_backend(stub_bases[0])
+    backend.client.slot_affinity = True
+    # parallel_slots is left at its default of 1, which would disable pinning.
+    assert "id_slot" not in backend.client._cache_fields("session-a")
+
+    async def run() -> None:
+        async with httpx.AsyncClient(timeout=2) as client:
+            await BackendPool([backend]).check_health(client)
+
+    asyncio.run(run())
+    assert backend.client.slot_count == 2
+    slots = {backend.client._cache_fields(f"session-{number}")["id_slot"] for number in range(32)}
+    assert slots == {0, 1}